@@ -0,0 +1,96 @@
+"""
+generates benchmark packs against the stand-in servers
+"""
+import random
+from pathlib import Path
+from typing import Dict, List
+
+import ruamel.yaml as yaml
+
+from servers import MC_VERSION, CurseMetaStandIn, ForgeStandIn, JenkinsStandIn, MavenStandIn, StandIn
+
+__all__ = ['PackLayout', 'generate_pack', 'write_config']
+
+
+class PackLayout:
+    """
+    how the entries of a pack of `size` entries are split across providers,
+    roughly like real packs: mostly curse, some maven libraries, jenkins builds and direct urls
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.mvn = max(1, size * 5 // 100)
+        self.jenkins = max(1, size * 3 // 100)
+        self.direct = max(1, size * 2 // 100)
+        self.curse = size - self.mvn - self.jenkins - self.direct
+        self.libraries = max(2, self.curse // 10)
+        # the pack uses half of the catalog, dependencies pull in libraries and optional addons
+        self.catalog = self.libraries + 2 * self.curse
+
+    def servers(self, seed: int = 0, file_size: int = 32 * 1024) -> Dict[str, 'StandIn']:
+        return {
+            'curse': CurseMetaStandIn(self.catalog, libraries=self.libraries, seed=seed, file_size=file_size),
+            'forge': ForgeStandIn(file_size=file_size),
+            'mvn': MavenStandIn(file_size=file_size),
+            'jenkins': JenkinsStandIn(self.jenkins, file_size=file_size),
+        }
+
+
+def generate_pack(layout: PackLayout, servers: Dict[str, 'StandIn'], seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    curse: CurseMetaStandIn = servers['curse']
+    mods: List = []
+    addon_ids = rng.sample(range(layout.libraries + 1, layout.catalog + 1), layout.curse)
+    for addon_id in addon_ids:
+        roll = rng.random()
+        if roll < 0.7:
+            mods.append(curse.name(addon_id))
+        elif roll < 0.9:
+            mods.append({'type': 'curse', 'addon_id': addon_id, 'side': 'client'})
+        else:
+            mods.append({'type': 'curse', 'name': curse.name(addon_id), 'selected': roll < 0.95,
+                         'description': f'optional addon {addon_id}'})
+    maven: MavenStandIn = servers['mvn']
+    for index in range(1, layout.mvn + 1):
+        mods.append({'type': 'mvn', 'remote_repository': f'{maven.url}/', 'group': maven.group,
+                     'artifact': f'bench-lib-{index}', 'version': 'release' if index % 2 else '1.1',
+                     'package_type': 'mod', 'path': 'mods'})
+    jenkins: JenkinsStandIn = servers['jenkins']
+    for index in range(1, layout.jenkins + 1):
+        mods.append({'type': 'jenkins', 'jenkins_url': jenkins.url, 'job': jenkins.job_name(index),
+                     'file_name_regex': r'.*(?<!-sources\.jar)$', 'package_type': 'mod', 'path': 'mods'})
+    for index in range(1, layout.direct + 1):
+        mods.append({'type': 'direct', 'url': f'{curse.url}/files/direct/{index}/direct-{index}.jar',
+                     'package_type': 'mod', 'path': 'mods'})
+    rng.shuffle(mods)
+
+    forge: ForgeStandIn = servers['forge']
+    return {
+        'name': f'bench-{layout.size}',
+        'title': f'benchmark pack with {layout.size} entries',
+        'mc_version': MC_VERSION,
+        'forge': 'recommended',
+        'forge_url': f'{forge.url}/json',
+        'provider_settings': {
+            'curse': {
+                'meta_url': curse.url,
+                'optional': False,
+                'release_types': ['Release', 'Beta'],
+            },
+        },
+        'mods': mods,
+    }
+
+
+def write_config(workdir: Path, pack: dict) -> Path:
+    """
+    writes a config directory with the pack into `workdir`, returns the path of the config
+    """
+    packs_path = Path(workdir, 'config', 'packs')
+    packs_path.mkdir(parents=True, exist_ok=True)
+    config_path = Path(workdir, 'config', 'config.yaml')
+    config_path.write_text('# benchmark config, packs are written to modpacks in the working directory\n')
+    with open(Path(packs_path, f"{pack['name']}.yaml"), 'w') as outfile:
+        yaml.safe_dump(pack, outfile, default_flow_style=False)
+    return config_path
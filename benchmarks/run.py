@@ -0,0 +1,149 @@
+"""
+end to end benchmark of `Voodoo.process_pack` against local stand-in servers
+
+every pack size is built three times, each build runs in its own process:
+  cold    empty cache and no lockfile
+  warm    `--update` with a warm cache, everything is resolved again
+  locked  unchanged config, entries come from the lockfile
+
+usage: python benchmarks/run.py [--sizes 50 500 5000] [--output benchmark-results.json]
+"""
+import argparse
+import contextlib
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List
+
+import simplejson as json
+
+from generate import PackLayout, generate_pack, write_config
+
+RUNS = ('cold', 'warm', 'locked')
+RESOLVE_PHASES = ('apply_defaults', 'prefetch', 'prepare_dependencies', 'forge', 'validate',
+                  'resolve_dependencies', 'features', 'fill_information', 'prepare_download')
+
+
+def peak_rss() -> int:
+    """
+    peak resident set size of this process in bytes
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def child(config: str, pack: str, result_path: str, update: bool):
+    """
+    builds the pack in this process and writes its profile and peak rss to `result_path`
+    """
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from voodoo.voodoo import Voodoo
+
+    with open(Path(result_path).with_suffix('.log'), 'w') as log, \
+            contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        voodoo = Voodoo(config, debug=False, pack=pack, export=False, update=update, profile=True)
+        voodoo.process_pack()
+    profile_path = Path('modpacks', pack, 'profile.json')
+    with open(profile_path) as infile:
+        report = json.load(infile)
+    report['peak_rss'] = peak_rss()
+    with open(result_path, 'w') as outfile:
+        json.dump(report, outfile)
+
+
+def build(workdir: Path, config: Path, pack: str, run: str) -> Dict[str, Any]:
+    result_path = Path(workdir, f'{run}.json')
+    env = dict(os.environ, XDG_CACHE_HOME=str(Path(workdir, 'cache')))
+    command = [sys.executable, str(Path(__file__).resolve()), '--child', str(config), pack, str(result_path)]
+    if run == 'warm':
+        command.append('--update')
+    process = subprocess.run(command, cwd=str(workdir), env=env)
+    if process.returncode != 0:
+        raise RuntimeError(f'{run} build of {pack} failed, see {result_path.with_suffix(".log")}')
+    with open(result_path) as infile:
+        return json.load(infile)
+
+
+def benchmark(size: int, workdir: Path, seed: int, file_size: int) -> List[Dict[str, Any]]:
+    layout = PackLayout(size)
+    servers = layout.servers(seed=seed, file_size=file_size)
+    for server in servers.values():
+        server.start()
+    try:
+        pack = generate_pack(layout, servers, seed=seed)
+        config = write_config(workdir, pack)
+        results = []
+        for run in RUNS:
+            before = {name: server.stats() for name, server in servers.items()}
+            report = build(workdir, config, pack['name'], run)
+            after = {name: server.stats() for name, server in servers.items()}
+            phases = report['phases']
+            download = phases.get('download', {}).get('seconds', 0.0)
+            file_bytes = sum(after[name]['file_bytes'] - before[name]['file_bytes'] for name in servers)
+            results.append({
+                'size': size,
+                'run': run,
+                'entries': report['entries'],
+                'total': report['total'],
+                'resolve': sum(phases[p]['seconds'] for p in RESOLVE_PHASES if p in phases),
+                'download': download,
+                'downloaded_bytes': file_bytes,
+                'throughput': file_bytes / download if download else 0.0,
+                'peak_rss': report['peak_rss'],
+                'requests': {name: after[name]['requests'] - before[name]['requests'] for name in servers},
+                'not_modified': sum(after[name]['not_modified'] - before[name]['not_modified'] for name in servers),
+                'phases': {name: phase['seconds'] for name, phase in phases.items()},
+                'cache': report['cache'],
+            })
+        return results
+    finally:
+        for server in servers.values():
+            server.stop()
+
+
+def table(results: List[Dict[str, Any]]) -> str:
+    lines = [f"{'size':>6} {'run':<7} {'entries':>7} {'total':>8} {'resolve':>8} {'download':>8} "
+             f"{'MB/s':>7} {'rss MB':>7} {'requests':>8} {'304':>6}"]
+    for r in results:
+        lines.append(f"{r['size']:>6} {r['run']:<7} {r['entries']:>7} {r['total']:>7.2f}s {r['resolve']:>7.2f}s "
+                     f"{r['download']:>7.2f}s {r['throughput'] / 2 ** 20:>7.1f} {r['peak_rss'] / 2 ** 20:>7.1f} "
+                     f"{sum(r['requests'].values()):>8} {r['not_modified']:>6}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark voodoo against local stand-in servers')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 500, 5000],
+                        help='number of entries of the generated packs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--file-size', type=int, default=32 * 1024, help='size of every served file in bytes')
+    parser.add_argument('--output', default='benchmark-results.json', help='where to write the results')
+    parser.add_argument('--keep', action='store_true', help='keep the working directories')
+    parser.add_argument('--child', nargs=3, metavar=('CONFIG', 'PACK', 'RESULT'), help=argparse.SUPPRESS)
+    parser.add_argument('--update', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child, update=args.update)
+        return
+
+    results = []
+    for size in args.sizes:
+        print(f'benchmarking a pack with {size} entries')
+        workdir = Path(tempfile.mkdtemp(prefix=f'voodoo-bench-{size}-'))
+        results.extend(benchmark(size, workdir, args.seed, args.file_size))
+        if args.keep:
+            print(f'kept {workdir}')
+        else:
+            subprocess.run(['rm', '-rf', str(workdir)])
+    print(table(results))
+    with open(args.output, 'w') as outfile:
+        json.dump(results, outfile, indent=2)
+    print(f'written results to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+"""
+local stand-ins for the services voodoo talks to, serving synthetic but deterministic data
+
+every service listens on its own port, so requests show up per host in the profile,
+all of them answer conditional requests with 304 and count the requests they served
+"""
+import hashlib
+import random
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any, Callable, Dict, List, Optional, Pattern, Tuple
+
+import simplejson as json
+
+__all__ = ['StandIn', 'CurseMetaStandIn', 'ForgeStandIn', 'MavenStandIn', 'JenkinsStandIn', 'payload']
+
+Response = Tuple[bytes, str]
+
+MC_VERSION = '1.12.2'
+FILE_TYPE = 'application/java-archive'
+
+
+def payload(path: str, size: int) -> bytes:
+    """
+    deterministic file content of `size` bytes for `path`
+    """
+    block = hashlib.sha256(path.encode()).digest() * 128
+    return (block * (size // len(block) + 1))[:size]
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops connections of parallel downloads
+    request_queue_size = 128
+
+
+class StandIn:
+    """
+    a http server on a free local port, subclasses register routes as (regex, handler) in `routes`
+
+    handlers get the regex match and return the body and content type or None for 404
+    """
+
+    def __init__(self, file_size: int = 32 * 1024):
+        self.file_size = file_size
+        self.routes: List[Tuple[Pattern, Callable[..., Optional[Response]]]] = []
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes = 0
+        self.file_bytes = 0
+        self._lock = threading.Lock()
+        self._server: _Server = None
+        self._thread: threading.Thread = None
+
+    def route(self, pattern: str, handler: Callable[..., Optional[Response]]):
+        self.routes.append((re.compile(pattern), handler))
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def file(self, match) -> Response:
+        return payload(match.group(0), self.file_size), FILE_TYPE
+
+    def handle(self, path: str) -> Optional[Response]:
+        for pattern, handler in self.routes:
+            match = pattern.fullmatch(path)
+            if match:
+                return handler(match)
+        return None
+
+    def start(self) -> 'StandIn':
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                response = stand_in.handle(self.path.split('?', 1)[0])
+                with stand_in._lock:
+                    stand_in.requests += 1
+                if response is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body, content_type = response
+                etag = f'"{hashlib.md5(body).hexdigest()}"'
+                if self.headers.get('If-None-Match') == etag:
+                    with stand_in._lock:
+                        stand_in.not_modified += 1
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                with stand_in._lock:
+                    stand_in.bytes += len(body)
+                    if content_type == FILE_TYPE:
+                        stand_in.file_bytes += len(body)
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = _Server(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'requests': self.requests, 'not_modified': self.not_modified, 'bytes': self.bytes,
+                    'file_bytes': self.file_bytes}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def _json(data: Any) -> Response:
+    return json.dumps(data).encode(), 'application/json'
+
+
+class CurseMetaStandIn(StandIn):
+    """
+    cursemeta catalog and file endpoints for `size` addons
+
+    the first `libraries` addons are libraries, every other addon requires 0 to `fan_out` of them
+    and optionally depends on a few addons with a lower id, so the dependency graph is acyclic.
+    popular libraries are picked more often, like in real packs
+    """
+
+    def __init__(self, size: int, libraries: int = None, fan_out: int = 3, files_per_addon: int = 3,
+                 seed: int = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.size = size
+        self.libraries = libraries or max(2, size // 20)
+        self.files_per_addon = files_per_addon
+        rng = random.Random(seed)
+        library_weights = [1 / (rank + 1) for rank in range(self.libraries)]
+        self.dependencies: Dict[int, List[dict]] = {}
+        for addon_id in range(1, size + 1):
+            dependencies = []
+            if addon_id > self.libraries:
+                count = rng.randint(0, fan_out)
+                required = set(rng.choices(range(1, self.libraries + 1), library_weights, k=count))
+                dependencies.extend({'addOnId': d, 'type': 1} for d in sorted(required))
+                if rng.random() < 0.2:
+                    optional = rng.randint(self.libraries + 1, addon_id - 1) if addon_id > self.libraries + 1 else None
+                    if optional:
+                        dependencies.append({'addOnId': optional, 'type': 2})
+            elif addon_id > 1 and rng.random() < 0.3:
+                # libraries depending on core libraries
+                dependencies.append({'addOnId': rng.randint(1, addon_id - 1), 'type': 1})
+            self.dependencies[addon_id] = dependencies
+
+        self._catalog = _json([self.addon(addon_id) for addon_id in range(1, size + 1)])
+        self.route(r'/api/addon/', lambda m: self._catalog)
+        self.route(r'/api/addon/(\d+)', self.get_addon)
+        self.route(r'/api/addon/(\d+)/files', self.get_files)
+        self.route(r'/api/addon/(\d+)/files/(\d+)', self.get_file)
+        self.route(r'/files/.+', self.file)
+
+    @staticmethod
+    def name(addon_id: int) -> str:
+        return f'Bench Addon {addon_id}'
+
+    def addon(self, addon_id: int) -> dict:
+        return {
+            'id': addon_id,
+            'name': self.name(addon_id),
+            'summary': f'synthetic addon {addon_id}',
+            'websiteURL': f'https://minecraft.curseforge.com/projects/bench-addon-{addon_id}',
+            'packageType': 'mod',
+            'categorySection.name': 'Mods',
+            'categorySection.path': 'mods',
+        }
+
+    def files(self, addon_id: int) -> List[dict]:
+        files = []
+        for index in range(1, self.files_per_addon + 1):
+            file_name = f'bench-addon-{addon_id}-{index}.0.jar'
+            files.append({
+                'id': addon_id * 100 + index,
+                'fileName': file_name,
+                'fileNameOnDisk': file_name,
+                'gameVersion': [MC_VERSION],
+                'releaseType': 1 if index % 2 else 2,
+                'fileDate': f'2018-01-{index:02d}T00:00:00',
+                'downloadURL': f'{self.url}/files/{addon_id}/{index}/{file_name}',
+                'dependencies': self.dependencies[addon_id],
+            })
+        return files
+
+    def get_addon(self, match) -> Optional[Response]:
+        addon_id = int(match.group(1))
+        if addon_id not in self.dependencies:
+            return None
+        return _json(self.addon(addon_id))
+
+    def get_files(self, match) -> Optional[Response]:
+        addon_id = int(match.group(1))
+        if addon_id not in self.dependencies:
+            return None
+        return _json(self.files(addon_id))
+
+    def get_file(self, match) -> Optional[Response]:
+        addon_id, file_id = int(match.group(1)), int(match.group(2))
+        if addon_id not in self.dependencies:
+            return None
+        file = next((f for f in self.files(addon_id) if f['id'] == file_id), None)
+        return _json(file) if file else None
+
+
+class ForgeStandIn(StandIn):
+    """
+    the forge `json` index with `builds` builds for `MC_VERSION` and their installers
+    """
+
+    def __init__(self, builds: int = 50, **kwargs):
+        super().__init__(**kwargs)
+        self.builds = builds
+        self.route(r'/json', self.get_index)
+        self.route(r'/files/.+', self.file)
+
+    def get_index(self, match) -> Response:
+        numbers = list(range(2000, 2000 + self.builds))
+        return _json({
+            'webpath': f'{self.url}/files',
+            'promos': {f'{MC_VERSION}-recommended': numbers[-2], f'{MC_VERSION}-latest': numbers[-1]},
+            'branches': {},
+            'mcversion': {MC_VERSION: numbers},
+            'number': {str(n): {'mcversion': MC_VERSION, 'version': f'14.23.{n}', 'branch': None}
+                       for n in numbers},
+        })
+
+
+class MavenStandIn(StandIn):
+    """
+    a maven repository with `maven-metadata.xml` for every artifact under `group`,
+    every artifact has `versions` versions that do not sort lexically
+    """
+
+    def __init__(self, group: str = 'bench.maven', versions: int = 12, **kwargs):
+        super().__init__(**kwargs)
+        self.group = group
+        self.versions = [f'1.{v}.{v * 3 % 11}' for v in range(1, versions + 1)]
+        group_path = re.escape(group.replace('.', '/'))
+        self.route(rf'/{group_path}/([^/]+)/maven-metadata\.xml', self.get_metadata)
+        self.route(rf'/{group_path}/([^/]+)/([^/]+)/[^/]+\.jar', self.file)
+
+    def get_metadata(self, match) -> Response:
+        artifact = match.group(1)
+        versions = ''.join(f'<version>{v}</version>' for v in self.versions)
+        body = (f'<metadata><groupId>{self.group}</groupId><artifactId>{artifact}</artifactId>'
+                f'<versioning><release>{self.versions[-1]}</release><versions>{versions}</versions>'
+                f'</versioning></metadata>')
+        return body.encode(), 'text/xml'
+
+
+class JenkinsStandIn(StandIn):
+    """
+    the python api of a jenkins server with `jobs` jobs and `builds` builds each,
+    as far as jenkinsapi reads it
+    """
+
+    def __init__(self, jobs: int, builds: int = 5, **kwargs):
+        super().__init__(**kwargs)
+        self.jobs = jobs
+        self.builds = builds
+        self.route(r'/api/python', self.get_jobs)
+        self.route(r'/job/([^/]+)/api/python', self.get_job)
+        self.route(r'/job/([^/]+)/(\d+)/api/python', self.get_build)
+        self.route(r'/job/([^/]+)/(\d+)/artifact/.+', self.file)
+
+    @staticmethod
+    def job_name(index: int) -> str:
+        return f'bench-job-{index}'
+
+    def _python(self, data: Any) -> Response:
+        return repr(data).encode(), 'text/x-python'
+
+    def _build(self, job: str, number: int) -> dict:
+        return {'number': number, 'url': f'{self.url}/job/{job}/{number}/'}
+
+    def get_jobs(self, match) -> Response:
+        return self._python({'jobs': [
+            {'name': self.job_name(i), 'color': 'blue', 'url': f'{self.url}/job/{self.job_name(i)}/'}
+            for i in range(1, self.jobs + 1)
+        ]})
+
+    def get_job(self, match) -> Response:
+        job = match.group(1)
+        last = self.builds
+        return self._python({
+            'name': job,
+            'url': f'{self.url}/job/{job}/',
+            'color': 'blue',
+            'builds': [self._build(job, n) for n in range(last, 0, -1)],
+            'firstBuild': self._build(job, 1),
+            'lastBuild': self._build(job, last),
+            'lastStableBuild': self._build(job, last),
+            'lastSuccessfulBuild': self._build(job, last),
+        })
+
+    def get_build(self, match) -> Optional[Response]:
+        job, number = match.group(1), int(match.group(2))
+        if not 0 < number <= self.builds:
+            return None
+        artifacts = [
+            {'fileName': f'{job}-{number}{suffix}.jar', 'displayPath': f'{job}-{number}{suffix}.jar',
+             'relativePath': f'build/libs/{job}-{number}{suffix}.jar'}
+            for suffix in ('', '-sources')
+        ]
+        return self._python({**self._build(job, number), 'result': 'SUCCESS', 'building': False,
+                             'actions': [], 'artifacts': artifacts})
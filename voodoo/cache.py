@@ -0,0 +1,472 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from threading import RLock
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import simplejson as json
+
+__all__ = ['ContentStore', 'CacheManager', 'CachedDocument', 'MetadataCache', 'file_hash', 'write_atomic', 'parse_size', 'format_size']
+
+HASH_ALGORITHM = 'sha256'
+
+
+def write_atomic(path: Path, data: bytes):
+    """
+    writes `data` to a temporary file next to `path` and renames it into place
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=str(path.parent), prefix=f'.{path.name}.', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_name, str(path))
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.unlink(temp_name)
+        raise
+
+
+def file_hash(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.new(HASH_ALGORITHM)
+    with open(path, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentStore:
+    """
+    content addressed file store
+
+    files are stored once as `objects/<hash[:2]>/<hash>`,
+    `index.json` maps urls to the hash of their content and the http validators
+    (ETag, Last-Modified) needed to revalidate them
+    """
+
+    def __init__(self, path: Path, debug: bool = False):
+        self.path = Path(path)
+        self.objects_path = self.path / 'objects'
+        self.temp_path = self.path / 'tmp'
+        self.index_path = self.path / 'index.json'
+        self.stats_path = self.path / 'stats.json'
+        self.debug = debug
+        self._index: Dict[str, Dict[str, Any]] = None
+        self._changed = set()
+        self._counters = Counter()
+        self._lock = RLock()
+
+    @property
+    def index(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            if self._index is None:
+                self._index = self._load_index()
+            return self._index
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        return self._load_json(self.index_path)
+
+    def load_stats(self) -> Dict[str, int]:
+        stats = Counter(self._load_json(self.stats_path))
+        stats.update(self._counters)
+        return dict(stats)
+
+    @staticmethod
+    def _load_json(path: Path) -> dict:
+        if not path.exists():
+            return {}
+        try:
+            with open(path, 'r') as json_file:
+                return json.load(json_file)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f'discarding broken cache file {path}: {e}')
+            return {}
+
+    @staticmethod
+    def _write_json(path: Path, data: dict):
+        write_atomic(path, json.dumps(data).encode())
+
+    def object_path(self, digest: str) -> Path:
+        return self.objects_path / digest[:2] / digest
+
+    def lookup(self, url: str) -> Optional[Dict[str, Any]]:
+        """
+        returns the index record for `url` if its object is present and intact
+        """
+        with self._lock:
+            record = self.index.get(url)
+            if not record:
+                return None
+            path = self.object_path(record['hash'])
+            try:
+                size = path.stat().st_size
+            except FileNotFoundError:
+                size = None
+            if size != record.get('size'):
+                if self.debug:
+                    print(f'cache object for {url} is missing or damaged')
+                del self.index[url]
+                self._changed.add(url)
+                return None
+            return record
+
+    def hit(self, url: str):
+        """
+        marks the object of `url` as used by this build
+        """
+        with self._lock:
+            record = self.index.get(url)
+            if record:
+                record['accessed'] = time.time()
+                self._changed.add(url)
+            self._counters['hits'] += 1
+
+    def miss(self, url: str):
+        with self._lock:
+            self._counters['misses'] += 1
+
+    def forget(self, urls: Iterable[str]):
+        with self._lock:
+            for url in urls:
+                if self.index.pop(url, None):
+                    self._changed.add(url)
+
+    def count(self, key: str, value: int = 1):
+        with self._lock:
+            self._counters[key] += value
+
+    @staticmethod
+    def validators(record: Dict[str, Any]) -> Dict[str, str]:
+        headers = {}
+        if record.get('etag'):
+            headers['If-None-Match'] = record['etag']
+        if record.get('last_modified'):
+            headers['If-Modified-Since'] = record['last_modified']
+        return headers
+
+    def temp_file(self, name: str = ''):
+        """
+        returns a file descriptor and path of a new temporary file inside the store,
+        so that it can be renamed into `objects` atomically
+        """
+        self.temp_path.mkdir(parents=True, exist_ok=True)
+        return tempfile.mkstemp(dir=str(self.temp_path), prefix=f'.{name}.', suffix='.part')
+
+    def commit(self, temp_path: Path, digest: str) -> Path:
+        """
+        moves a finished temporary file into the store,
+        identical content that is already stored is kept and the new copy dropped
+        """
+        path = self.object_path(digest)
+        if path.exists():
+            os.unlink(str(temp_path))
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # temporary files are private, stored files may be linked into packs
+            os.chmod(str(temp_path), 0o644)
+            os.replace(str(temp_path), str(path))
+        return path
+
+    def add_file(self, source: Path) -> str:
+        """
+        copies an existing file into the store and returns its hash
+        """
+        fd, temp_name = self.temp_file(Path(source).name)
+        os.close(fd)
+        try:
+            shutil.copyfile(str(source), temp_name)
+            digest = file_hash(Path(temp_name))
+            self.commit(Path(temp_name), digest)
+        except BaseException:
+            if os.path.exists(temp_name):
+                os.unlink(temp_name)
+            raise
+        return digest
+
+    def record(self, url: str, digest: str, etag: str = None, last_modified: str = None):
+        size = self.object_path(digest).stat().st_size
+        with self._lock:
+            self.index[url] = {
+                'hash': digest,
+                'size': size,
+                'etag': etag,
+                'last_modified': last_modified,
+                'accessed': time.time(),
+                'validated': time.time(),
+            }
+            self._changed.add(url)
+
+    def validated(self, url: str):
+        """
+        marks the object of `url` as revalidated with the server
+        """
+        with self._lock:
+            record = self.index.get(url)
+            if record:
+                record['validated'] = time.time()
+                self._changed.add(url)
+
+    def save(self):
+        """
+        merges the changed records and counters into the files on disk,
+        so that concurrent builds sharing the cache do not drop each others records
+        """
+        with self._lock:
+            if self._changed:
+                index = self._load_index()
+                for url in self._changed:
+                    record = self.index.get(url)
+                    if record:
+                        index[url] = record
+                    else:
+                        index.pop(url, None)
+                self._write_json(self.index_path, index)
+                self._index = index
+                self._changed.clear()
+            if self._counters:
+                self._write_json(self.stats_path, self.load_stats())
+                self._counters.clear()
+
+
+class CachedDocument:
+    """
+    a http response body kept on disk together with its validators,
+    used for metadata that is revalidated or refreshed after a ttl
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.meta_path = self.path.with_name(self.path.name + '.meta')
+        self._meta = None
+
+    @property
+    def meta(self) -> Dict[str, Any]:
+        if self._meta is None:
+            self._meta = ContentStore._load_json(self.meta_path) if self.path.exists() else {}
+        return self._meta
+
+    def exists(self) -> bool:
+        return bool(self.meta)
+
+    def age(self) -> float:
+        """
+        seconds since the document was fetched or revalidated
+        """
+        if not self.exists():
+            return float('inf')
+        return time.time() - self.meta.get('fetched', 0)
+
+    def fresh(self, ttl: float) -> bool:
+        return ttl is not None and self.age() < ttl
+
+    def validators(self) -> Dict[str, str]:
+        return ContentStore.validators(self.meta) if self.exists() else {}
+
+    def load_json(self) -> Any:
+        with open(self.path, 'rb') as stream:
+            return json.load(stream)
+
+    def store(self, content: bytes, headers: Mapping[str, str] = None, **extra):
+        headers = headers or {}
+        write_atomic(self.path, content)
+        self._meta = {
+            'fetched': time.time(),
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'hash': hashlib.new(HASH_ALGORITHM, content).hexdigest(),
+            **extra
+        }
+        ContentStore._write_json(self.meta_path, self._meta)
+
+    def touch(self):
+        """
+        marks the document as revalidated
+        """
+        self.meta['fetched'] = time.time()
+        ContentStore._write_json(self.meta_path, self.meta)
+
+
+class MetadataCache:
+    """
+    json records persisted as one file per key under `path`,
+    kept in memory after the first access and shared by everything using the same path
+    """
+
+    def __init__(self, path: Path, ttl: float = None):
+        self.path = Path(path)
+        self.ttl = ttl
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._lock = RLock()
+
+    def _record(self, key: Any) -> Optional[Dict[str, Any]]:
+        key = str(key)
+        with self._lock:
+            if key not in self._records:
+                self._records[key] = ContentStore._load_json(self.path / f'{key}.json') or None
+            return self._records[key]
+
+    def get(self, key: Any, ttl: Optional[float] = ...) -> Any:
+        """
+        returns the value stored for `key` if it is younger than `ttl`,
+        `ttl=None` accepts any age
+        """
+        if ttl is ...:
+            ttl = self.ttl
+        record = self._record(key)
+        if not record:
+            return None
+        if ttl is not None and time.time() - record['fetched'] >= ttl:
+            return None
+        return record['value']
+
+    def put(self, key: Any, value: Any, fetched: float = None):
+        record = {
+            'fetched': fetched if fetched is not None else time.time(),
+            'value': value
+        }
+        with self._lock:
+            self._records[str(key)] = record
+        ContentStore._write_json(self.path / f'{key}.json', record)
+
+    def fetched(self, key: Any) -> Optional[float]:
+        record = self._record(key)
+        return record['fetched'] if record else None
+
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(size: Any) -> Optional[int]:
+    """
+    parses sizes like `500M` or `10G` into bytes, `None` means unlimited
+    """
+    if size is None or isinstance(size, int):
+        return size
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*', str(size), re.IGNORECASE)
+    assert match, f'invalid size {size}'
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.upper()])
+
+
+def format_size(size: int) -> str:
+    for unit in ('', 'K', 'M', 'G'):
+        if size < 1024:
+            return f'{size:.1f}{unit}B' if unit else f'{size}B'
+        size /= 1024
+    return f'{size:.1f}TB'
+
+
+class CacheManager:
+    """
+    keeps the download cache below `max_size` bytes
+
+    objects of the store are evicted least recently used first,
+    files in the per entry cache directories of older versions are evicted by modification time
+    """
+
+    legacy_dirs = ('curse', 'direct', 'forge', 'github', 'jenkins', 'local', 'mvn')
+
+    def __init__(self, cache_dir: Path, store: ContentStore, max_size: Any = None):
+        self.cache_dir = Path(cache_dir)
+        self.store = store
+        self.max_size = parse_size(max_size)
+
+    def files(self) -> List[Tuple[float, int, Path, List[str]]]:
+        """
+        lists all evictable files as (last access, size, path, urls)
+        """
+        urls_by_hash: Dict[str, List[str]] = {}
+        accessed_by_hash: Dict[str, float] = {}
+        for url, record in self.store.index.items():
+            digest = record['hash']
+            urls_by_hash.setdefault(digest, []).append(url)
+            accessed_by_hash[digest] = max(accessed_by_hash.get(digest, 0), record.get('accessed', 0))
+
+        files = []
+        if self.store.objects_path.is_dir():
+            for path in self.store.objects_path.glob('*/*'):
+                stat = path.stat()
+                # objects without any url are unreachable and go first
+                accessed = accessed_by_hash.get(path.name, 0)
+                files.append((accessed, stat.st_size, path, urls_by_hash.get(path.name, [])))
+        for legacy_dir in self.legacy_dirs:
+            legacy_path = self.cache_dir / legacy_dir
+            if not legacy_path.is_dir():
+                continue
+            for path in legacy_path.rglob('*'):
+                if path.is_file():
+                    stat = path.stat()
+                    files.append((stat.st_mtime, stat.st_size, path, []))
+        return files
+
+    def stats(self) -> Dict[str, Any]:
+        files = self.files()
+        stats = self.store.load_stats()
+        hits, misses = stats.get('hits', 0), stats.get('misses', 0)
+        return {
+            'path': str(self.cache_dir),
+            'files': len(files),
+            'size': sum(size for _, size, _, _ in files),
+            'max_size': self.max_size,
+            'urls': len(self.store.index),
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else None,
+            'evictions': stats.get('evictions', 0),
+            'evicted_bytes': stats.get('evicted_bytes', 0),
+        }
+
+    def prune(self, max_size: Any = None) -> Tuple[int, int]:
+        """
+        evicts the least recently used files until the cache fits into `max_size`,
+        returns the number of removed files and freed bytes
+        """
+        max_size = parse_size(max_size) if max_size is not None else self.max_size
+        if max_size is None:
+            return 0, 0
+        files = sorted(self.files(), key=lambda f: f[0])
+        total = sum(size for _, size, _, _ in files)
+        removed, freed = 0, 0
+        for _, size, path, urls in files:
+            if total <= max_size:
+                break
+            self.remove(path, urls)
+            total -= size
+            removed += 1
+            freed += size
+        self.store.count('evictions', removed)
+        self.store.count('evicted_bytes', freed)
+        self.store.save()
+        return removed, freed
+
+    def verify(self) -> List[Path]:
+        """
+        rehashes every object of the store and removes the ones that do not match their name
+        """
+        broken = []
+        for _, _, path, urls in self.files():
+            if self.store.objects_path not in path.parents:
+                continue
+            if file_hash(path) != path.name:
+                print(f'removing damaged object {path}')
+                self.remove(path, urls)
+                broken.append(path)
+        # drop records of objects that are gone
+        for url in list(self.store.index.keys()):
+            self.store.lookup(url)
+        self.store.save()
+        return broken
+
+    def remove(self, path: Path, urls: List[str]):
+        path.unlink()
+        self.store.forget(urls)
+        parent = path.parent
+        while parent != self.cache_dir and parent.is_dir() and not any(parent.iterdir()):
+            parent.rmdir()
+            parent = parent.parent
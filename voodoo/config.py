@@ -0,0 +1,220 @@
+import copy
+import hashlib
+import os
+import pickle
+from pathlib import Path
+from threading import RLock
+from typing import Any, Dict, List, Optional, Tuple
+
+import ruamel.yaml as yaml
+
+from .cache import write_atomic
+
+__all__ = ['ConfigError', 'ConfigLoader', 'merge_config']
+
+Stamp = Optional[Tuple[int, int]]
+
+SEPARATOR = '\n# END DEFAULTS\n\n# BEGIN CONFIG\n\n'
+
+# list keys that are combined instead of replaced when packs are included
+MERGED_LISTS = ('mods',)
+
+
+class ConfigError(Exception):
+    pass
+
+
+def _stamp(path: Path) -> Stamp:
+    try:
+        stat = os.stat(str(path))
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def merge_config(base: Any, override: Any, key: str = None) -> Any:
+    """
+    merges `override` into `base` without changing either,
+    dicts are merged recursively, `mods` lists are combined and everything else is replaced
+    """
+    if isinstance(base, dict) and isinstance(override, dict):
+        merged = dict(base)
+        for k, value in override.items():
+            merged[k] = merge_config(base[k], value, k) if k in base else value
+        return merged
+    if key in MERGED_LISTS and isinstance(base, list) and isinstance(override, list):
+        return base + override
+    return override
+
+
+class ConfigLoader:
+    """
+    loads configs layered from the bundled defaults, `config.yaml` and a pack file
+
+    pack files can use the anchors of the defaults and the global config
+    and include other packs with `include: [pack, ...]`, the included packs are merged in order
+    and the pack itself is merged on top.
+    every file is parsed once, parsed files are kept in memory by modification time and size
+    and in `cache_path` by the hash of their content
+    """
+
+    def __init__(self, defaults_path: Path, config_path: Path, cache_path: Path = None, debug: bool = False):
+        self.defaults_path = Path(defaults_path)
+        self.config_path = Path(config_path)
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.debug = debug
+        self._lock = RLock()
+        self._base: Tuple[Tuple[Stamp, Stamp], str, str, dict] = None
+        self._base_anchors: Dict[str, Any] = None
+        # resolved pack files by path: (base key, merged data, stamps of the file and all its includes)
+        self._packs: Dict[Path, Tuple[str, dict, Dict[Path, Stamp]]] = {}
+
+    @staticmethod
+    def _parse(text: str, anchors: Dict[str, Any] = None) -> Tuple[Any, Dict[str, Any]]:
+        """
+        parses `text` with `anchors` of an earlier document,
+        returns the data and the anchors including the ones of `text`
+        """
+        loader = yaml.SafeLoader(text)
+        # the composer adds the anchors of this document to the dict it starts with
+        loader.anchors = document_anchors = dict(anchors or {})
+        try:
+            data = loader.get_single_data()
+        finally:
+            loader.dispose()
+        return data, document_anchors
+
+    def _load_cached(self, key: str) -> Any:
+        if not self.cache_path:
+            return None
+        try:
+            with open(Path(self.cache_path, f'{key}.pickle'), 'rb') as stream:
+                return pickle.load(stream)
+        except (OSError, pickle.PickleError, EOFError, AttributeError):
+            return None
+
+    def _store(self, key: str, data: Any):
+        if self.cache_path:
+            try:
+                write_atomic(Path(self.cache_path, f'{key}.pickle'), pickle.dumps(data))
+            except OSError as e:
+                if self.debug:
+                    print(f'failed to cache parsed config: {e}')
+
+    def _load_base(self) -> Tuple[str, str, dict]:
+        """
+        the defaults followed by the global config, parsed as one document
+        """
+        stamps = (_stamp(self.defaults_path), _stamp(self.config_path))
+        if self._base and self._base[0] == stamps:
+            return self._base[1:]
+        text = self.defaults_path.read_text(encoding='utf-8') + SEPARATOR
+        if self.config_path.exists():
+            text += self.config_path.read_text(encoding='utf-8')
+        key = hashlib.sha256(text.encode()).hexdigest()
+        data = self._load_cached(key)
+        if data is None:
+            if self.debug:
+                print(f'parsing {self.config_path}')
+            data, self._base_anchors = self._parse(text)
+            self._store(key, data)
+        else:
+            self._base_anchors = None
+        self._base = (stamps, text, key, data)
+        self._packs.clear()
+        return text, key, data
+
+    def _anchors(self) -> Dict[str, Any]:
+        """
+        anchors of the defaults and the global config, only needed to parse changed pack files
+        """
+        text, key, _ = self._load_base()
+        if self._base_anchors is None:
+            _, self._base_anchors = self._parse(text)
+        return self._base_anchors
+
+    def _load_fragment(self, path: Path, base_key: str) -> dict:
+        text = path.read_text(encoding='utf-8')
+        key = hashlib.sha256((base_key + text).encode()).hexdigest()
+        data = self._load_cached(key)
+        if data is None:
+            if self.debug:
+                print(f'parsing {path}')
+            data, _ = self._parse(text, self._anchors())
+            self._store(key, data)
+        if data is None:
+            data = {}
+        if not isinstance(data, dict):
+            raise ConfigError(f'{path} does not contain a mapping')
+        return data
+
+    @staticmethod
+    def find_include(name: str, including: Path) -> Path:
+        for candidate in (Path(including.parent, name), Path(including.parent, f'{name}.yaml')):
+            if candidate.is_file():
+                return candidate.resolve()
+        raise ConfigError(f'{name} included by {including} not found')
+
+    def _resolve(self, path: Path, stack: Tuple[Path, ...] = ()) -> Tuple[dict, Dict[Path, Stamp]]:
+        if path in stack:
+            cycle = [p.stem for p in stack[stack.index(path):]] + [path.stem]
+            raise ConfigError(f"include cycle {' -> '.join(cycle)}")
+        _, base_key, _ = self._load_base()
+        known = self._packs.get(path)
+        if known and known[0] == base_key and all(_stamp(p) == s for p, s in known[2].items()):
+            return known[1], known[2]
+
+        stamps = {path: _stamp(path)}
+        data = self._load_fragment(path, base_key)
+        includes = data.get('include') or []
+        if isinstance(includes, str):
+            includes = [includes]
+        merged = {}
+        for name in includes:
+            included, included_stamps = self._resolve(self.find_include(str(name), path), stack + (path,))
+            # a pack including an abstract base is not abstract itself
+            merged = merge_config(merged, {k: v for k, v in included.items() if k != 'abstract'})
+            stamps.update(included_stamps)
+        merged = merge_config(merged, {k: v for k, v in data.items() if k != 'include'})
+        self._packs[path] = (base_key, merged, stamps)
+        return merged, stamps
+
+    def global_config(self) -> dict:
+        with self._lock:
+            _, _, data = self._load_base()
+            return copy.deepcopy(data)
+
+    def load_pack(self, path: Path) -> dict:
+        """
+        the global config with the pack and its includes on top
+        """
+        with self._lock:
+            _, _, base = self._load_base()
+            pack, _ = self._resolve(Path(path).resolve())
+            return copy.deepcopy({**base, **pack})
+
+    def is_abstract(self, path: Path) -> bool:
+        """
+        packs that are only included by other packs, they set `abstract: true` or have no `name`
+        """
+        with self._lock:
+            pack, _ = self._resolve(Path(path).resolve())
+            return bool(pack.get('abstract')) or not pack.get('name')
+
+    def dependencies(self, path: Path) -> List[Path]:
+        """
+        the pack file and all files it includes, as far as it was loaded already
+        """
+        known = self._packs.get(Path(path).resolve())
+        return list(known[2]) if known else [Path(path).resolve()]
+
+    def base_text(self) -> str:
+        with self._lock:
+            text, _, _ = self._load_base()
+            return text
+
+    def pack_text(self, path: Path) -> str:
+        """
+        the global config and the pack as one document, for debugging
+        """
+        return self.base_text() + SEPARATOR + Path(path).read_text(encoding='utf-8')
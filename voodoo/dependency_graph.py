@@ -1,11 +1,13 @@
 from pathlib import Path
 from typing import List
 
-from graphviz import Digraph
-
 from .cftypes import DependencyType, Side
+from .entry import EntryRegistry
+
+def generate_graph(entries: EntryRegistry, path: Path, pack_name: str):
+    # graphviz is only imported when a graph is generated
+    from graphviz import Digraph
 
-def generate_graph(entries: List[dict], path: Path, pack_name: str):
     side_color = {
         Side.Client: 'lawngreen',
         Side.Server: 'deepskyblue',
@@ -86,7 +88,7 @@ def generate_graph(entries: List[dict], path: Path, pack_name: str):
         for dep_type, dep_list in depends.items():
             for dependency in dep_list:
                 dep_type = DependencyType.get(dep_type)
-                if not any(e.get('name') == dependency for e in entries):
+                if entries.by_name(dependency) is None:
                     if dep_type == DependencyType.Embedded:
                         dot.node(dependency, dependency, style='dotted')
                     else:
@@ -0,0 +1,104 @@
+import sys
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from .materialize import Materializer
+from .profiling import Profiler
+from .provider.BaseProvider import BaseProvider
+
+__all__ = ['DownloadEngine', 'DownloadError']
+
+
+class DownloadError(Exception):
+    """
+    raised after all downloads finished when some of them failed
+    """
+
+    def __init__(self, failed: List[Tuple[dict, BaseException]]):
+        self.failed = failed
+        names = ', '.join(str(entry.get('name') or entry.get('file_name')) for entry, _ in failed)
+        super().__init__(f'{len(failed)} downloads failed: {names}')
+
+
+class DownloadEngine:
+    """
+    Runs provider downloads on a bounded thread pool
+
+    `workers` limits the downloads running at the same time,
+    `host_workers` limits the downloads running against the same host.
+    downloads are only handed to the pool when their host has capacity,
+    so a busy host never holds workers that other hosts could use.
+    status lines are printed in entry order, independent of completion order
+    """
+
+    def __init__(self, workers: int = 8, host_workers: int = 4, debug: bool = False, profiler: Profiler = None):
+        self.workers = max(1, int(workers or 1))
+        self.host_workers = max(1, int(host_workers or 1))
+        self.debug = debug
+        self.profiler = profiler or Profiler(enabled=False)
+
+    def _run(self, provider: BaseProvider, entry: dict, pack_path: Path, materializer: Materializer) -> str:
+        # summed over all workers, so it can exceed the wall time of the download phase
+        with self.profiler.phase('download_worker', provider._typ):
+            return provider.download(entry, pack_path, materializer)
+
+    def download(self, jobs: Iterable[Tuple[BaseProvider, dict]], pack_path: Path, materializer: Materializer):
+        jobs = list(jobs)
+        if self.debug:
+            print(f'downloading {len(jobs)} entries with {self.workers} workers, '
+                  f'{self.host_workers} per host')
+        # waiting jobs by host, hosts are served round robin
+        queues: Dict[str, Deque[int]] = OrderedDict()
+        for index, (provider, entry) in enumerate(jobs):
+            queues.setdefault(provider.download_host(entry), deque()).append(index)
+        running_by_host: Dict[str, int] = {host: 0 for host in queues}
+        running: Dict[Future, Tuple[int, str]] = {}
+        results: List[Optional[Tuple[Optional[str], Optional[BaseException]]]] = [None] * len(jobs)
+        failed: List[Tuple[dict, BaseException]] = []
+        printed = 0
+
+        def next_job() -> Optional[Tuple[int, str]]:
+            for host in list(queues):
+                if running_by_host[host] < self.host_workers:
+                    index = queues[host].popleft()
+                    if queues[host]:
+                        queues.move_to_end(host)
+                    else:
+                        del queues[host]
+                    return index, host
+            return None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while queues or running:
+                while len(running) < self.workers:
+                    job = next_job()
+                    if job is None:
+                        break
+                    index, host = job
+                    provider, entry = jobs[index]
+                    running_by_host[host] += 1
+                    running[executor.submit(self._run, provider, entry, pack_path, materializer)] = job
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, host = running.pop(future)
+                    running_by_host[host] -= 1
+                    try:
+                        results[index] = (future.result(), None)
+                    except Exception as e:
+                        results[index] = (None, e)
+
+                while printed < len(jobs) and results[printed] is not None:
+                    status, error = results[printed]
+                    if error is not None:
+                        entry = jobs[printed][1]
+                        name = entry.get('name') or entry.get('file_name')
+                        print(f'[{name}] download failed: {error!r}', file=sys.stderr)
+                        failed.append((entry, error))
+                    elif status:
+                        print(status)
+                    printed += 1
+        if failed:
+            raise DownloadError(failed)
@@ -0,0 +1,180 @@
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import ruamel.yaml as yaml
+
+__all__ = ['Entry', 'EntryRegistry']
+
+_missing = object()
+
+
+class Entry(MutableMapping):
+    """
+    a single pack entry, behaves like the dict it was created from
+
+    common keys are kept in slots, any other key in `_extra` that is only created once it is needed,
+    changes to `name`, `type` and `addon_id` update the indexes of the registry that owns the entry
+    """
+
+    __slots__ = (
+        'type', 'name', 'addon_id', 'file_id', 'file_name', 'url', 'path', 'file_path', 'target_path',
+        'package_type', 'side', 'depends', 'provides', 'description', 'feature_name', 'selected',
+        'recommendation', 'version', 'mc_version', 'release_types', 'optional', 'file_name_regex',
+        'cache_base', 'cache_path', 'websited_url', 'immutable', 'build_number', '_extra', '_registry',
+    )
+    _fields = frozenset(__slots__[:-2])
+    _indexed = frozenset(('name', 'type', 'addon_id'))
+
+    def __init__(self, *args, **kwargs):
+        self._extra: Optional[Dict[str, Any]] = None
+        self._registry: 'EntryRegistry' = None
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._fields:
+            value = getattr(self, key, _missing)
+            if value is _missing:
+                raise KeyError(key)
+            return value
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self._fields:
+            value = getattr(self, key, _missing)
+            return default if value is _missing else value
+        if self._extra is None:
+            return default
+        return self._extra.get(key, default)
+
+    def __contains__(self, key: Any) -> bool:
+        if key in self._fields:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __setitem__(self, key: str, value: Any):
+        registry = self._registry if key in self._indexed else None
+        if registry is not None:
+            registry._unindex(self)
+        if key in self._fields:
+            setattr(self, key, value)
+        elif self._extra is None:
+            self._extra = {key: value}
+        else:
+            self._extra[key] = value
+        if registry is not None:
+            registry._index(self)
+
+    def __delitem__(self, key: str):
+        if key not in self:
+            raise KeyError(key)
+        registry = self._registry if key in self._indexed else None
+        if registry is not None:
+            registry._unindex(self)
+        if key in self._fields:
+            delattr(self, key)
+        else:
+            del self._extra[key]
+        if registry is not None:
+            registry._index(self)
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self.__slots__[:-2]:
+            if hasattr(self, key):
+                yield key
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f'Entry({dict(self)!r})'
+
+
+def _represent_entry(representer, entry: Entry):
+    return representer.represent_dict(dict(entry))
+
+
+yaml.representer.SafeRepresenter.add_representer(Entry, _represent_entry)
+yaml.representer.Representer.add_representer(Entry, _represent_entry)
+
+
+class EntryRegistry:
+    """
+    ordered entries of a pack with indexes by name, type and addon_id
+    """
+
+    def __init__(self, entries: Iterable[dict] = ()):
+        self._entries: List[Entry] = []
+        # every index maps a key to the entries with that key by their id, in insertion order
+        self._by_name: Dict[str, Dict[int, Entry]] = {}
+        self._by_type: Dict[str, Dict[int, Entry]] = {}
+        self._by_addon_id: Dict[int, Dict[int, Entry]] = {}
+        for entry in entries:
+            self.add(entry)
+
+    def _indexes(self, entry: Entry):
+        return ((self._by_name, entry.get('name')),
+                (self._by_type, entry.get('type')),
+                (self._by_addon_id, entry.get('addon_id')))
+
+    def _index(self, entry: Entry):
+        for index, key in self._indexes(entry):
+            if key is not None:
+                index.setdefault(key, {})[id(entry)] = entry
+
+    def _unindex(self, entry: Entry):
+        for index, key in self._indexes(entry):
+            indexed = index.get(key)
+            if indexed is None:
+                continue
+            indexed.pop(id(entry), None)
+            if not indexed:
+                del index[key]
+
+    def add(self, entry: dict) -> Entry:
+        """
+        adds `entry`, plain dicts are converted to a `Entry`
+        """
+        if not isinstance(entry, Entry) or entry._registry not in (None, self):
+            entry = Entry(entry)
+        entry._registry = self
+        self._entries.append(entry)
+        self._index(entry)
+        return entry
+
+    append = add
+
+    def remove(self, entry: Entry):
+        index = next(i for i, e in enumerate(self._entries) if e is entry)
+        del self._entries[index]
+        self._unindex(entry)
+        entry._registry = None
+
+    def __iter__(self) -> Iterator[Entry]:
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getitem__(self, index: int) -> Entry:
+        return self._entries[index]
+
+    def by_name(self, name: str) -> Optional[Entry]:
+        entries = self._by_name.get(name)
+        return next(iter(entries.values())) if entries else None
+
+    def by_type(self, typ: str) -> List[Entry]:
+        return list(self._by_type.get(typ, {}).values())
+
+    def by_addon_id(self, addon_id: int) -> Optional[Entry]:
+        entries = self._by_addon_id.get(addon_id)
+        return next(iter(entries.values())) if entries else None
+
+    def names(self) -> Iterable[str]:
+        return self._by_name.keys()
+
+    def to_list(self) -> List[dict]:
+        return [dict(e) for e in self._entries]
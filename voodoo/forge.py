@@ -0,0 +1,95 @@
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+__all__ = ['ForgeIndex']
+
+
+class ForgeIndex:
+    """
+    the parts of the forge version json needed to find installers,
+    with lookups precomputed so resolving a forge version does not walk the whole document
+
+    `promos`: promo name (eg. `1.12.2-recommended`) -> build
+    `branches`: branch -> mc version -> latest build
+    `mcversions`: mc version -> sorted builds
+    `builds`: build -> (mc version, forge version, branch)
+    """
+
+    def __init__(self, webpath: str, promos: Dict[str, int], branches: Dict[str, Dict[str, int]],
+                 mcversions: Dict[str, List[int]], builds: Dict[int, Tuple[str, str, Optional[str]]]):
+        self.webpath = webpath
+        self.promos = promos
+        self.branches = branches
+        self.mcversions = mcversions
+        self.builds = builds
+        # when the index was loaded and if it was fetched or revalidated at that time
+        self.loaded = time.time()
+        self.checked = False
+
+    @classmethod
+    def from_forge_data(cls, data: Dict[str, Any]) -> 'ForgeIndex':
+        builds = {}
+        mcversions: Dict[str, List[int]] = {}
+        for number, file_data in data['number'].items():
+            build = int(number)
+            mcversion = file_data['mcversion']
+            builds[build] = (mcversion, file_data['version'], file_data.get('branch'))
+            mcversions.setdefault(mcversion, []).append(build)
+        for mc_builds in mcversions.values():
+            mc_builds.sort()
+
+        branches: Dict[str, Dict[str, int]] = {}
+        for branch, branch_builds in (data.get('branches') or {}).items():
+            if isinstance(branch_builds, int):
+                branch_builds = [branch_builds]
+            latest = branches[branch] = {}
+            for build in branch_builds:
+                if build in builds:
+                    mcversion = builds[build][0]
+                    latest[mcversion] = max(build, latest.get(mcversion, build))
+
+        promos = {name: build for name, build in (data.get('promos') or {}).items() if build in builds}
+        return cls(data['webpath'], promos, branches, mcversions, builds)
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> 'ForgeIndex':
+        builds = {int(build): tuple(file_data) for build, file_data in data['builds'].items()}
+        return cls(data['webpath'], data['promos'], data['branches'], data['mcversions'], builds)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'webpath': self.webpath,
+            'promos': self.promos,
+            'branches': self.branches,
+            'mcversions': self.mcversions,
+            'builds': {str(build): list(file_data) for build, file_data in self.builds.items()},
+        }
+
+    def find_build(self, version: Union[int, str], mc_version: str) -> Optional[int]:
+        """
+        resolves a build number, `recommended`/`latest`, a promo, a branch
+        or a mc version to the build number of a forge release for `mc_version`
+        """
+        if isinstance(version, int):
+            return version if version in self.builds else None
+        if version in ('recommended', 'latest'):
+            return self.promos.get(f'{mc_version}-{version}')
+        if version in self.promos:
+            return self.promos[version]
+        if version in self.branches:
+            return self.branches[version].get(mc_version)
+        if version == mc_version and self.mcversions.get(version):
+            return self.mcversions[version][-1]
+        return None
+
+    def installer(self, build: int) -> Tuple[str, str, str]:
+        """
+        url, file name and long version of the installer of `build`
+        """
+        mcversion, forge_version, branch = self.builds[build]
+        longversion = f'{mcversion}-{forge_version}'
+        if branch:
+            longversion = f'{longversion}-{branch}'
+        filename = f'forge-{longversion}-installer.jar'
+        url = f'{self.webpath}/{longversion}/{filename}'
+        return url, filename, longversion
@@ -0,0 +1,96 @@
+from threading import Lock
+from typing import Any, Dict, Iterator
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+__all__ = ['HttpClient']
+
+
+class HttpClient:
+    """
+    http client shared by all providers
+
+    keeps a pool of keep-alive connections per host,
+    retries failed requests with exponential backoff and applies a default timeout.
+    `stats` counts requests, received bytes and latency until the response headers per host,
+    the bytes of streamed responses are counted by `iter_content` while they are read
+    """
+
+    retry_status = (429, 500, 502, 503, 504)
+
+    def __init__(self, timeout: float = 30, retries: int = 3, backoff: float = 0.5, pool_size: int = 16):
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff,
+                      status_forcelist=self.retry_status, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.stats: Dict[str, Dict[str, Any]] = {}
+        self._lock = Lock()
+        # counts every request of the session, including those of jenkinsapi
+        self.session.hooks['response'].append(self._count_response)
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            response = self.session.get(url, **kwargs)
+        except requests.RequestException:
+            self.count(urlparse(url).netloc, errors=1)
+            raise
+        return response
+
+    def iter_content(self, response: requests.Response, chunk_size: int) -> Iterator[bytes]:
+        """
+        reads a streamed response and counts its bytes
+        """
+        size = 0
+        try:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.count(urlparse(response.url).netloc, bytes=size)
+
+    def _count_response(self, response: requests.Response, *args, **kwargs):
+        latency = response.elapsed.total_seconds()
+        # chunked responses have no `Content-Length`, the body of a streamed response is not read yet
+        self.count(urlparse(response.url).netloc,
+                   requests=1,
+                   bytes=0 if kwargs.get('stream') else len(response.content),
+                   latency=latency,
+                   latency_max=latency,
+                   not_modified=int(response.status_code == 304),
+                   errors=int(response.status_code >= 400))
+
+    def count(self, host: str, **values: float):
+        with self._lock:
+            stats = self.stats.get(host)
+            if not stats:
+                stats = self.stats[host] = dict(requests=0, bytes=0, latency=0.0, latency_max=0.0,
+                                                not_modified=0, errors=0)
+            for key, value in values.items():
+                if key == 'latency_max':
+                    stats[key] = max(stats[key], value)
+                else:
+                    stats[key] += value
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {host: dict(stats) for host, stats in self.stats.items()}
+
+    def stats_since(self, snapshot: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        stats of the requests since `snapshot` was taken, `latency_max` is kept for the whole session
+        """
+        since = {}
+        for host, stats in self.snapshot().items():
+            before = snapshot.get(host, {})
+            since[host] = {k: v if k == 'latency_max' else v - before.get(k, 0) for k, v in stats.items()}
+        return {host: stats for host, stats in since.items() if stats['requests'] or stats['errors']}
+
+    def close(self):
+        self.session.close()
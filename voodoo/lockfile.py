@@ -0,0 +1,74 @@
+import copy
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import simplejson as json
+
+from .cache import write_atomic
+
+__all__ = ['Lockfile', 'config_hash']
+
+LOCK_VERSION = 1
+
+
+def config_hash(data: Any) -> str:
+    """
+    stable hash of config values, independent of key order
+    """
+    dump = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(dump.encode()).hexdigest()
+
+
+class Lockfile:
+    """
+    fully resolved entries and features of a pack
+
+    the lock is reused as long as the hash of the merged pack config matches,
+    `pins` keep the resolved versions of single entries by the hash of their definition
+    so that a changed config only resolves the entries that changed
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.data: Dict[str, Any] = {}
+        if self.path.exists():
+            try:
+                with open(self.path, 'r') as lock_file:
+                    self.data = json.load(lock_file)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f'ignoring broken lockfile {self.path}: {e}')
+        if self.data.get('version') != LOCK_VERSION:
+            self.data = {}
+
+    def matches(self, pack_hash: str) -> bool:
+        return bool(self.data) and self.data.get('config_hash') == pack_hash
+
+    @property
+    def entries(self) -> List[dict]:
+        return copy.deepcopy(self.data.get('entries', []))
+
+    @property
+    def features(self) -> List[dict]:
+        return copy.deepcopy(self.data.get('features', []))
+
+    @property
+    def pins(self) -> Dict[str, Dict[str, Any]]:
+        return copy.deepcopy(self.data.get('pins', {}))
+
+    def pin(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.data.get('pins', {}).get(key)
+
+    def write(self, pack_hash: str, entries: List[dict], features: List[dict], pins: Dict[str, Dict[str, Any]]):
+        self.data = {
+            'version': LOCK_VERSION,
+            'config_hash': pack_hash,
+            'pins': pins,
+            'features': features,
+            'entries': entries,
+        }
+        # json round trip to get rid of anything that is not plain data
+        dump = json.dumps(self.data, indent=2, sort_keys=True, default=str)
+        self.data = json.loads(dump)
+        write_atomic(self.path, dump.encode())
+        print(f'written lockfile {self.path}')
@@ -0,0 +1,202 @@
+import errno
+import os
+import shutil
+import uuid
+from pathlib import Path
+from threading import RLock
+from typing import Any, Dict, Iterable, List
+
+import simplejson as json
+
+from .cache import file_hash, write_atomic
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = ['Materializer']
+
+# linux ioctl to clone a file on copy-on-write filesystems (btrfs, xfs)
+FICLONE = 0x40049409
+
+
+class Materializer:
+    """
+    keeps the files of a pack in sync with the resolved entries
+
+    every placed file is recorded in a manifest with size, mtime and hash,
+    files that still match their record are left alone and
+    files in the managed folders that are not placed anymore are removed by `prune`
+
+    `mode` sets how files are placed:
+    `copy`, `hardlink`, `reflink` (copy-on-write clone), `symlink`
+    or `auto` which tries a reflink and copies otherwise,
+    every mode falls back to a copy when the filesystem does not support it
+    """
+
+    modes = {
+        'copy': ('copy',),
+        'hardlink': ('hardlink', 'copy'),
+        'reflink': ('reflink', 'copy'),
+        'symlink': ('symlink', 'copy'),
+        'auto': ('reflink', 'copy'),
+    }
+
+    def __init__(self, output_path: Path, manifest_path: Path,
+                 managed: Iterable[str] = ('src/mods', 'loaders'), mode: str = 'auto', debug: bool = False):
+        assert mode in self.modes, f"unknown materialize mode {mode}, use one of {', '.join(self.modes)}"
+        self.mode = mode
+        self.output_path = Path(output_path)
+        self.manifest_path = Path(manifest_path)
+        self.managed = [Path(self.output_path, m) for m in managed]
+        self.debug = debug
+        self._manifest: Dict[str, Dict[str, Any]] = {}
+        self._expected = set()
+        self._lock = RLock()
+        if self.manifest_path.exists():
+            try:
+                with open(self.manifest_path, 'r') as manifest_file:
+                    self._manifest = json.load(manifest_file)
+            except (OSError, json.JSONDecodeError):
+                self._manifest = {}
+
+    def _key(self, target: Path) -> str:
+        try:
+            return Path(os.path.abspath(str(target))).relative_to(os.path.abspath(str(self.output_path))).as_posix()
+        except ValueError:
+            return Path(os.path.abspath(str(target))).as_posix()
+
+    def _current(self, key: str, target: Path, digest: str) -> bool:
+        record = self._manifest.get(key)
+        if not record or record.get('hash') != digest or record.get('mode', 'copy') != self.mode:
+            return False
+        try:
+            stat = target.stat()
+        except OSError:
+            return False
+        return record.get('size') == stat.st_size and record.get('mtime') == stat.st_mtime_ns
+
+    def _record(self, key: str, target: Path, digest: str, **extra):
+        stat = target.stat()
+        with self._lock:
+            self._manifest[key] = dict(size=stat.st_size, mtime=stat.st_mtime_ns, hash=digest, mode=self.mode, **extra)
+
+    def _source_hash(self, key: str, source: Path) -> str:
+        """
+        hash of a file outside the store, only rehashed when size or mtime of the source changed
+        """
+        stat = source.stat()
+        record = self._manifest.get(key) or {}
+        source_record = record.get('source') or {}
+        if source_record.get('size') == stat.st_size and source_record.get('mtime') == stat.st_mtime_ns:
+            return record['hash']
+        return file_hash(source)
+
+    def place(self, source: Path, target: Path, digest: str = None) -> bool:
+        """
+        copies `source` to `target` unless the target already has the same content
+        `digest` is the known hash of `source`, it is calculated if missing
+        returns whether the file was written
+        """
+        source = Path(source)
+        target = Path(target)
+        key = self._key(target)
+        extra = {}
+        if not digest:
+            digest = self._source_hash(key, source)
+            stat = source.stat()
+            extra['source'] = dict(size=stat.st_size, mtime=stat.st_mtime_ns)
+        with self._lock:
+            self._expected.add(key)
+        if self._current(key, target, digest):
+            if extra:
+                self._record(key, target, digest, **extra)
+            return False
+        target.parent.mkdir(parents=True, exist_ok=True)
+        temp = target.parent / f'.{target.name}.{uuid.uuid4().hex}.part'
+        try:
+            self._materialize(source, temp)
+            os.replace(str(temp), str(target))
+        except BaseException:
+            if os.path.lexists(str(temp)):
+                os.unlink(str(temp))
+            raise
+        self._record(key, target, digest, **extra)
+        return True
+
+    def _materialize(self, source: Path, temp: Path):
+        for mode in self.modes[self.mode]:
+            try:
+                getattr(self, f'_{mode}')(source, temp)
+                return
+            except OSError as e:
+                if mode == 'copy' or e.errno not in (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL,
+                                                     errno.ENOSYS, errno.EPERM, errno.EMLINK):
+                    raise
+                if self.debug:
+                    print(f'{mode} of {source.name} failed ({e.strerror}), falling back')
+                if os.path.lexists(str(temp)):
+                    os.unlink(str(temp))
+
+    @staticmethod
+    def _copy(source: Path, temp: Path):
+        shutil.copyfile(str(source), str(temp))
+
+    @staticmethod
+    def _hardlink(source: Path, temp: Path):
+        os.link(str(source), str(temp))
+
+    @staticmethod
+    def _symlink(source: Path, temp: Path):
+        os.symlink(os.path.abspath(str(source)), str(temp))
+
+    @staticmethod
+    def _reflink(source: Path, temp: Path):
+        if fcntl is None:
+            raise OSError(errno.EOPNOTSUPP, 'reflinks are not supported on this platform')
+        with open(str(source), 'rb') as source_file, open(str(temp), 'wb') as temp_file:
+            fcntl.ioctl(temp_file.fileno(), FICLONE, source_file.fileno())
+
+    def write_bytes(self, target: Path, data: bytes) -> bool:
+        """
+        writes small generated files like `.url.txt` only when their content changed
+        """
+        target = Path(target)
+        with self._lock:
+            self._expected.add(self._key(target))
+        try:
+            if target.read_bytes() == data:
+                return False
+        except OSError:
+            pass
+        write_atomic(target, data)
+        return True
+
+    def prune(self) -> List[Path]:
+        """
+        removes all files in the managed folders that were not placed in this run
+        """
+        removed = []
+        for base in self.managed:
+            if not base.is_dir():
+                continue
+            for root, dirs, files in os.walk(str(base), topdown=False):
+                for name in files:
+                    path = Path(root, name)
+                    if self._key(path) not in self._expected:
+                        path.unlink()
+                        removed.append(path)
+                        if self.debug:
+                            print(f'removed stale {path}')
+                for name in dirs:
+                    path = Path(root, name)
+                    if not any(path.iterdir()):
+                        path.rmdir()
+        return removed
+
+    def save(self):
+        with self._lock:
+            manifest = {k: v for k, v in self._manifest.items()
+                        if k in self._expected or Path(self.output_path, k).exists()}
+        write_atomic(self.manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode())
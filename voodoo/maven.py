@@ -0,0 +1,78 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import xmltodict
+
+__all__ = ['MavenMetadata', 'version_key']
+
+# qualifier order of maven, unknown qualifiers sort after all of these
+QUALIFIERS = {
+    'alpha': 0, 'a': 0,
+    'beta': 1, 'b': 1,
+    'milestone': 2, 'm': 2,
+    'rc': 3, 'cr': 3,
+    'snapshot': 4,
+    '': 5, 'ga': 5, 'final': 5, 'release': 5,
+    'sp': 6,
+}
+RELEASE = (1, QUALIFIERS[''], '')
+
+
+def version_key(version: str) -> Tuple[Tuple[int, int, str], ...]:
+    """
+    sort key ordering versions like maven does, so `1.2.10` > `1.2.9`,
+    `1.0-rc1` < `1.0` < `1.0-sp1` and `1.0.0` == `1`
+    """
+    items: List[Tuple[int, int, str]] = []
+    for token in re.findall(r'\d+|[a-z]+', version.lower()):
+        if token.isdigit():
+            items.append((2, int(token), ''))
+            continue
+        # zeros before a qualifier do not count, `1.0-rc1` is `1-rc1`
+        while items and items[-1] == (2, 0, ''):
+            items.pop()
+        rank = QUALIFIERS.get(token)
+        items.append((1, rank, '') if rank is not None else (1, len(QUALIFIERS), token))
+    while items and items[-1] in ((2, 0, ''), RELEASE):
+        items.pop()
+    # every version ends like a release, so `1-alpha` < `1` < `1.1` and `1` < `1-sp`
+    items.append(RELEASE)
+    return tuple(items)
+
+
+class MavenMetadata:
+    """
+    release and versions of an artifact from its `maven-metadata.xml`, versions are sorted in maven order
+    """
+
+    def __init__(self, release: Optional[str], versions: List[str]):
+        self.release = release
+        self.versions = sorted(versions, key=version_key)
+
+    @classmethod
+    def from_xml(cls, content: bytes) -> 'MavenMetadata':
+        metadata = xmltodict.parse(content).get('metadata') or {}
+        versioning = metadata.get('versioning') or {}
+        versions = (versioning.get('versions') or {}).get('version') or []
+        # a single version is not parsed as a list
+        if isinstance(versions, str):
+            versions = [versions]
+        release = versioning.get('release') or metadata.get('version')
+        return cls(release, versions)
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> 'MavenMetadata':
+        return cls(data['release'], data['versions'])
+
+    def to_json(self) -> Dict[str, Any]:
+        return {'release': self.release, 'versions': self.versions}
+
+    def find_version(self, version: str) -> Optional[str]:
+        """
+        `release` or the newest version containing `version`
+        """
+        if version == 'release':
+            return self.release
+        # TODO: regex
+        matching = [v for v in self.versions if version in v]
+        return matching[-1] if matching else None
@@ -0,0 +1,117 @@
+import time
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict
+
+import simplejson as json
+
+from .cache import format_size, write_atomic
+
+__all__ = ['Profiler']
+
+
+class _Timer:
+    __slots__ = ('profiler', 'phase', 'provider', 'start')
+
+    def __init__(self, profiler: 'Profiler', phase: str, provider: str = None):
+        self.profiler = profiler
+        self.phase = phase
+        self.provider = provider
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.phase, time.perf_counter() - self.start, self.provider)
+        return False
+
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_no_timer = _NoTimer()
+
+
+class Profiler:
+    """
+    collects wall time per phase and per provider of a build
+
+    `phase` times a block, with `provider` the time is also added to that provider,
+    phases that are entered multiple times (eg. once per entry) are summed up.
+    a disabled profiler does nothing
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.phases: Dict[str, float] = OrderedDict()
+        self.calls: Dict[str, int] = {}
+        self.providers: Dict[str, Dict[str, float]] = {}
+        self.started = time.perf_counter()
+        self._lock = Lock()
+
+    def phase(self, name: str, provider: str = None):
+        if not self.enabled:
+            return _no_timer
+        return _Timer(self, name, provider)
+
+    def add(self, name: str, seconds: float, provider: str = None):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if provider:
+                provider_phases = self.providers.setdefault(provider, {})
+                provider_phases[name] = provider_phases.get(name, 0.0) + seconds
+
+    def report(self, http_stats: Dict[str, Dict[str, Any]] = None, cache_stats: Dict[str, int] = None,
+               **extra) -> Dict[str, Any]:
+        http_stats = http_stats or {}
+        cache_stats = cache_stats or {}
+        hits, misses = cache_stats.get('hits', 0), cache_stats.get('misses', 0)
+        return {
+            'total': time.perf_counter() - self.started,
+            'phases': {name: {'seconds': seconds, 'calls': self.calls[name]}
+                       for name, seconds in self.phases.items()},
+            'providers': self.providers,
+            'http': {
+                'requests': sum(s['requests'] for s in http_stats.values()),
+                'bytes': sum(s['bytes'] for s in http_stats.values()),
+                'hosts': http_stats,
+            },
+            'cache': {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else None,
+            },
+            **extra,
+        }
+
+    def write(self, path: Path, report: Dict[str, Any]):
+        write_atomic(Path(path), json.dumps(report, indent=2).encode())
+        print(f'written profile to {path}')
+
+    @staticmethod
+    def summary(report: Dict[str, Any]) -> str:
+        lines = [f"total {report['total']:.2f}s"]
+        phases = sorted(report['phases'].items(), key=lambda p: p[1]['seconds'], reverse=True)
+        for name, phase in phases:
+            lines.append(f"  {name:<24} {phase['seconds']:8.3f}s")
+        http = report['http']
+        lines.append(f"http: {http['requests']} requests, {format_size(http['bytes'])}")
+        for host, stats in sorted(http['hosts'].items()):
+            latency = stats['latency'] / stats['requests'] if stats['requests'] else 0
+            lines.append(f"  {host:<32} {stats['requests']:5d} requests {format_size(stats['bytes']):>10} "
+                         f"avg {latency * 1000:.0f}ms max {stats['latency_max'] * 1000:.0f}ms")
+        cache = report['cache']
+        hit_rate = cache['hit_rate']
+        lines.append(f"cache: {cache['hits']} hits, {cache['misses']} misses"
+                     f"{f', hit rate {hit_rate:.1%}' if hit_rate is not None else ''}")
+        return '\n'.join(lines)
@@ -3,10 +3,13 @@ import json
 import sys
 from pathlib import Path
 from typing import Any, Dict, List
-from urllib.parse import quote
+from urllib.parse import quote, urlparse
 
 import ruamel.yaml as yaml
 
+from ..materialize import Materializer
+from ..resolver import DependencyResolver, FeatureResolver
+
 __all__ = ['BaseProvider']
 
 
@@ -19,6 +22,10 @@ class BaseProvider:
     _required_attributes = ()
     _defaults = {}
     _typ = None
+    # keys that pin the resolved version of an entry in the lockfile
+    _pin_keys = ()
+    # settings of the provider itself, they are not applied to entries
+    _settings_only = ()
 
     def from_dict(self, entry: dict):
         return entry #TODO: filter out not optiona and not requires
@@ -29,8 +36,13 @@ class BaseProvider:
 
     debug = False
     default_mc_version = None
+    cache_dir = None
+    store = None
+    http = None
     
     def __init__(self, *args, **kwargs):
+        # per instance, providers of other types and other packs must not see these settings
+        self._defaults = {}
         if type(self) is BaseProvider:
             return
         if self.debug:
@@ -81,7 +93,8 @@ class BaseProvider:
                 if self.debug:
                     print(f'setting {attribute_key}, value={value}')
                 setattr(self, attribute_key, provider_settings[attribute_key])
-                self._defaults[attribute_key]=provider_settings[attribute_key]
+                if attribute_key not in self._settings_only:
+                    self._defaults[attribute_key]=provider_settings[attribute_key]
 
     def apply_defaults(self, entry: dict):
         if self.debug:
@@ -94,96 +107,32 @@ class BaseProvider:
                 if self.debug:
                     print(f"{key} = {value}")
 
+    def prefetch(self, entries: List[dict]):
+        """
+        called once with all entries of this provider before `prepare_dependencies`,
+        to load remote data for all of them at once
+        """
+        pass
+
     def prepare_dependencies(self, entry: dict):
         pass
 
     def validate(self, entry: dict) -> bool:
         pass
 
-    def resolve_dependencies(self, entry: dict, entries: List[dict]):
+    def resolve_dependencies(self, entry: dict, resolver: DependencyResolver):
+        """
+        called once for every entry, including dependencies that were added by `resolver`
+        """
         pass
 
-    def resolve_feature_dependencies(self, entry: dict, entries: List[dict], features: List[dict]):
+    def resolve_feature_dependencies(self, entry: dict, features: FeatureResolver):
         # check if it is a feature
         entry_name = entry.get('name')
         feature_name = entry.get('feature_name', entry_name)
-        feature = next((f for f in features if f['name'] == feature_name), None)
-        if 'selected' in entry and not feature:
-            # find features
-
-            # add feature
-            print(entry)
-            feature = {
-                'name': feature_name,
-                'names': [feature_name],
-                'entry_refs': [
-                    entry['name']
-                ],
-                'processed_entries': []
-                #'addon_refs': [entry.get('name')]
-            }
-            existing = [f for f in features if entry_name in f['entry_refs']]
-            for f in existing:
-                print(f'TODO: DUPLICATE {f} and add {entry_name}')
+        if 'selected' in entry and not features.get(feature_name):
             #TODO: if entry is found in other features, duplicate all and add yourself
-            features.append(feature)
-
-            self.process_feature(feature, entries, features)
-
-    def process_feature(self, feature: dict, entries: list, features: list):
-        print(f'processing {feature}')
-        feature_name = feature['name']
-        while(len(feature['processed_entries']) < len(feature['entry_refs'])):
-            processable_entries = [e for e in feature['entry_refs'] if e not in feature['processed_entries']]
-            print(f'processable: {processable_entries}')
-            for entry_ref in processable_entries:
-                print(f'searching {entry_ref}')
-                entry = next((e for e in entries if e.get('name') == entry_ref), None)
-                if not entry:
-                    print(f'{entry_ref} not in entries')
-                    feature['processed_entries'].append(entry_ref)
-                    continue
-
-                depends = entry.get('depends', {})
-                # flatdepends = [d for _, deps in depends.items() for d in deps]
-                dep_names = [d for deps in depends.values() for d in deps]
-                print(f'dep_names: {dep_names}')
-
-                # only add what is found in entries
-                dep_names = [d for d in dep_names if any(d == e.get('name') for e in entries)]
-                print(f'filtered dep_names: {dep_names}')
-                for dep in dep_names:
-                    if dep not in feature['entry_refs']:
-                        feature['entry_refs'].append(dep)
-
-                # # find all features with any intersection
-                # existing = []
-                # for f in features:
-                #     for e in f['entry_refs']:
-                #         if e in dep_names:
-                #             existing.append(f)
-                # print(existing)
-                # for f in existing:
-                #     print(f'{f} + {feature}')
-                #     if any(na in feature['names'] for na in f['names']):
-                #         print(f'{feature_name} tried to duplicate intersecting values')
-                #         continue
-                #     merged_name = f['name'] + '_' + feature['name']
-                #     merged = next((fe for fe in features if fe['name'] == merged_name), None)
-                #     if merged:
-                #         print(f'already exists {merged}')
-                #     if not merged:
-                #         print(f"merging {f['names']} \n{feature['names']}\n")
-                #         merged = {
-                #             'name': f['name'] + '_' + feature['name'],
-                #             'names': [*f['names'], *feature['names']],
-                #             'entry_refs': [*f['entry_refs'], *feature['entry_refs']],
-                #             'processed_entries': [*f['processed_entries'], *feature['processed_entries']],
-                #         }
-                #         features.append(merged)
-                #     self.process_feature(merged, entries, features)
-                
-                feature['processed_entries'].append(entry_ref)
+            features.add(feature_name, entry_name)
 
     def fill_information(self, entry: dict):
         if 'feature_name' not in entry and 'name' in entry and 'selected' in entry:
@@ -192,9 +141,25 @@ class BaseProvider:
     def prepare_download(self, entry: dict, cache_base: Path):
         pass
 
-    def download(self, entry: dict, src_path: Path):
+    def download(self, entry: dict, src_path: Path, materializer: Materializer) -> str:
+        """
+        places the file of `entry` into the pack through `materializer`
+        may run on a worker thread, returns the status line to print
+        """
+        pass
+
+    def finish(self):
+        """
+        called once after the pack is built, waits for work the provider does in the background
+        """
         pass
 
+    def download_host(self, entry: dict) -> str:
+        url = entry.get('url')
+        if url:
+            return urlparse(url).netloc
+        return self._typ
+
     def convert(self, entry: Any) -> dict:
         if isinstance(entry, dict):
             return entry
@@ -261,7 +226,7 @@ class BaseProvider:
         entry['file_path'] = str(Path(path, entry.get(
             'file_name')))
 
-    def write_direct_url(self, entry: dict, src_path: Path):
+    def write_direct_url(self, entry: dict, src_path: Path, materializer: Materializer):
         url = entry.get('url')
         direct = entry.get('direct', True)
         if not direct:
@@ -271,10 +236,7 @@ class BaseProvider:
             filename = quote(filename, safe="/")
             url = url + "/" + filename
             url_path = Path(src_path, f"{entry['file_path']}.url.txt").resolve(strict=False)
-            Path(url_path.parent).mkdir(parents=True, exist_ok=True)
-
-            with open(url_path, "wb") as urlFile:
-                urlFile.write(str.encode(url))
+            materializer.write_bytes(url_path, str.encode(url))
         else:
             print(f"ERROR: {entry} misses 'url'", file=sys.stderr)
 
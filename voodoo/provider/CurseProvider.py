@@ -1,17 +1,34 @@
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from itertools import groupby
 from pathlib import Path
 import re
-from typing import Any, Dict, List, Mapping, Tuple
+from threading import RLock, Thread
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+from urllib.parse import urlparse
 
 import requests
 import ruamel.yaml as yaml
+import simplejson as json
 
+from ..cache import CachedDocument, ContentStore, MetadataCache, write_atomic
 from ..cftypes import *
+from ..lockfile import config_hash
+from ..resolver import DependencyResolver
 from .BaseProvider import BaseProvider
 
 __all__ = ['CurseProvider']
 
 
+def slugify(name: str) -> str:
+    """
+    normalizes addon names the way curse builds project slugs
+    `Just Enough Items (JEI)` -> `just-enough-items-jei`
+    """
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+
 class CurseProvider(BaseProvider):
     """
     Gets mods and their dependencies from curse
@@ -20,8 +37,14 @@ class CurseProvider(BaseProvider):
     # optional = ("addon_id", "name", "mc_version", "release_type", "no_required", "no_optional")
     _required_attributes = ()
     _typ = 'curse'
+    _pin_keys = ('addon_id', 'file_id', 'file_name')
+    _settings_only = ('dump_data', 'dump_format', 'catalog_ttl', 'files_ttl', 'prefetch_workers')
 
-    __file_cache = {}
+    __file_caches: Dict[Path, MetadataCache] = {}
+    _file_lock = RLock()
+    # loaded and indexed catalogs by meta_url, shared by all packs built in this process
+    __catalogs: Dict[str, tuple] = {}
+    _catalog_lock = RLock()
 
     def from_str(self, data: str):
         return {'name': data, 'type': self._typ}
@@ -38,17 +61,72 @@ class CurseProvider(BaseProvider):
     release_types = [str(RLType.Release), str(RLType.Beta)]
     meta_url: str = 'https://cursemeta.nikky.moe'
     dump_data = True
+    dump_format = 'yaml'
+    catalog_ttl = 24 * 60 * 60
+    files_ttl = 60 * 60
+    prefetch_workers = 8
     file_name_regex = r'.*(?<!-deobf\.jar)$'
 
     def __init__(self, *args, **kwargs):  # optional, default_release_types,
         super().__init__(*args, **kwargs)
 
-        data_path = kwargs['data_path']
-        self.addon_data = self.get_addon_data()
-        if self.dump_data:
+        self.data_path = kwargs['data_path']
+        files_path = self.meta_cache_path() / 'files'
+        with self._file_lock:
+            if files_path not in self.__file_caches:
+                self.__file_caches[files_path] = MetadataCache(files_path)
+        self._file_cache = self.__file_caches[files_path]
+
+        # the catalog is fetched by `load_addon_data` when the first addon is looked up
+        self.addon_data: List[Mapping[str, Any]] = None
+        self._catalog_hash: str = None
+        self._dump_thread: Thread = None
+
+    def load_addon_data(self):
+        """
+        fetches and indexes the addon catalog once per meta_url, the dump is written in the background
+        """
+        if self.addon_data is not None:
+            return
+        with self._catalog_lock:
+            if self.addon_data is not None:
+                return
+            catalog = self.__catalogs.get(self.meta_url)
+            # long running processes load the catalog again once it is due for revalidation
+            if catalog is None or self.catalog_ttl is None or time.time() - catalog[0] >= self.catalog_ttl:
+                addon_data = self.get_addon_data()
+                self.index_addon_data(addon_data)
+                catalog = self.__catalogs[self.meta_url] = (
+                    time.time(), addon_data, self._addons_by_id, self._addons_by_name, self._addons_by_slug,
+                    self.catalog_snapshot().meta.get('hash'))
+            (_, addon_data, self._addons_by_id, self._addons_by_name, self._addons_by_slug,
+             self._catalog_hash) = catalog
+            self.addon_data = addon_data
+            if self.dump_data:
+                self._dump_thread = Thread(target=self.dump_addon_data, name='curse-dump')
+                self._dump_thread.start()
+
+    def finish(self):
+        if self._dump_thread:
+            self._dump_thread.join()
+            self._dump_thread = None
+
+    def dump_addon_data(self):
+        """
+        writes the catalog into `data/addons` with one file per category,
+        skipped when the catalog, meta_url and format are the same as for the last dump
+        """
+        assert self.dump_format in ('yaml', 'jsonl'), f'unknown dump_format {self.dump_format}'
+        path = Path(self.data_path, 'addons')
+        marker_path = path / '.catalog.json'
+        marker = {'hash': self._catalog_hash, 'meta_url': self.meta_url, 'format': self.dump_format}
+        if self._catalog_hash and ContentStore._load_json(marker_path) == marker:
+            if self.debug:
+                print(f'addon dump in {path} is up to date')
+            return
+        try:
             key = 'categorySection.name'
             for addon_type, addons in groupby(sorted(self.addon_data, key=lambda k: k[key]), lambda d: d[key]):
-                path = Path(data_path, 'addons', f'{addon_type}.yaml')
                 addon_data = dict()
                 for addon in addons:
                     website_url = addon['websiteURL']
@@ -56,18 +134,102 @@ class CurseProvider(BaseProvider):
                     api_url = f'{self.meta_url}/api/addon/{addon_id}'
                     addon_data[addon['name']] = {
                         'webste_url': website_url, 'api_url': api_url}
-                Path(path.parent).mkdir(parents=True, exist_ok=True)
-                with open(path, 'w') as outfile:
-                    yaml.dump(addon_data, outfile, default_flow_style=False)
+                if self.dump_format == 'jsonl':
+                    content = ''.join(json.dumps({'name': name, **data}) + '\n' for name, data in addon_data.items())
+                else:
+                    content = yaml.dump(addon_data, default_flow_style=False)
+                write_atomic(path / f'{addon_type}.{self.dump_format}', content.encode())
+            write_atomic(marker_path, json.dumps(marker).encode())
+        except Exception as e:
+            print(f'WARNING: failed to dump addon data to {path}: {e}', file=sys.stderr)
+
+    def index_addon_data(self, addon_data: List[Mapping[str, Any]]):
+        """
+        indexes the catalog by id, exact name and slug, the first addon wins on duplicate names
+        """
+        self._addons_by_id: Dict[int, Mapping[str, Any]] = {}
+        self._addons_by_name: Dict[str, Mapping[str, Any]] = {}
+        self._addons_by_slug: Dict[str, Mapping[str, Any]] = {}
+        for addon in addon_data:
+            self._addons_by_id.setdefault(addon['id'], addon)
+            self._addons_by_name.setdefault(addon['name'], addon)
+            self._addons_by_slug.setdefault(slugify(addon['name']), addon)
+            website_url = addon.get('websiteURL')
+            if website_url:
+                self._addons_by_slug.setdefault(website_url.rstrip('/').rsplit('/', 1)[-1].lower(), addon)
+
+    def find_add_on(self, addon_id: int = None, name: str = None) -> Optional[Mapping[str, Any]]:
+        self.load_addon_data()
+        addon = None
+        if addon_id:
+            addon = self._addons_by_id.get(addon_id)
+        if not addon and name:
+            addon = self._addons_by_name.get(name) or self._addons_by_slug.get(slugify(name))
+        return addon
 
     def match_dict(self, entry: dict):
         # print(f"checking for name or addon_id in {entry}")
         return 'addon_id' in entry or 'name' in entry
 
+    def prefetch(self, entries: List[dict]):
+        """
+        fetches the file lists of all addons that the entries and their dependencies need,
+        with `prefetch_workers` requests in parallel, so that resolving only hits the cache
+        """
+        def visit(param: dict, optional: bool) -> List[int]:
+            addon_id, file_id, _ = self.find_file(**param, quiet=True)
+            if file_id is None or file_id < 0:
+                return []
+            addon_file = self.get_add_on_file(addon_id, file_id)
+            dependencies = []
+            for dependency in addon_file['dependencies']:
+                dep_type = DependencyType.get(dependency['type'])
+                if dep_type == DependencyType.Required or (dep_type == DependencyType.Optional and optional):
+                    dependencies.append(dependency['addOnId'])
+            return dependencies
+
+        if not entries:
+            return
+        # load the catalog before the workers need it
+        self.load_addon_data()
+        seen = set()
+        with ThreadPoolExecutor(max_workers=self.prefetch_workers) as executor:
+            pending = set()
+            for entry in entries:
+                addon = self.find_add_on(addon_id=entry.get('addon_id'), name=entry.get('name'))
+                if addon:
+                    seen.add(addon['id'])
+                pending.add(executor.submit(visit, self.find_file_param(entry), entry.get('optional')))
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        dependencies = future.result()
+                    except requests.RequestException as e:
+                        # resolving runs into the same error and reports it properly
+                        if self.debug:
+                            print(f'prefetch failed: {e}')
+                        continue
+                    for dep_addon_id in dependencies:
+                        if dep_addon_id in seen:
+                            continue
+                        seen.add(dep_addon_id)
+                        # the same parameters resolve_dependencies uses for new entries
+                        param = {'addon_id': dep_addon_id, 'mc_version': self.default_mc_version,
+                                 'file_name_regex': self.file_name_regex}
+                        pending.add(executor.submit(visit, param, False))
+        if self.debug:
+            print(f'prefetched files of {len(seen)} addons')
+
+    @staticmethod
+    def find_file_param(entry: dict) -> dict:
+        return {k: entry[k] for k in (
+            'addon_id', 'name', 'mc_version', 'version', 'release_types', 'file_name_regex') if k in entry}
+
     def prepare_dependencies(self, entry: dict):
         # get addon_id, file_id
-        param = {k: entry[k] for k in (
-            'addon_id', 'name', 'mc_version', 'version', 'release_types', 'file_name_regex') if k in entry}
+        param = self.find_file_param(entry)
         addon_id, file_id, file_name = self.find_file(**param)
         entry['addon_id'] = addon_id
         entry['file_id'] = file_id
@@ -80,8 +242,7 @@ class CurseProvider(BaseProvider):
             return False
         return True
 
-    def resolve_dependencies(self, entry: dict, entries: List[dict]):
-        # returns multiple values
+    def resolve_dependencies(self, entry: dict, resolver: DependencyResolver):
         addon_id = entry['addon_id']
         file_id = entry['file_id']
         addon = self.get_add_on(addon_id)
@@ -94,45 +255,35 @@ class CurseProvider(BaseProvider):
 
             dep_addon = self.get_add_on(dep_addon_id)
 
-            depends = entry.get('depends', {})
-            depend_list = depends.get(str(dep_type), [])
-            depend_list.append(dep_addon['name'])
-            depends[str(dep_type)] = depend_list
-            entry['depends'] = depends
-
-            # find duplicat entry
-            dep_entry = next((e for e in entries if (e['type'] == 'curse' and e.get(
-                'addon_id') == dep_addon_id) or e.get('name') == dep_addon['name']), None)
+            # find duplicate entry
+            dep_entry = resolver.find(name=dep_addon['name'], addon_id=dep_addon_id)
             if not dep_entry:
                 if dep_type == DependencyType.Required or (dep_type == DependencyType.Optional and entry.get('optional')):
-                    dep_addon_id, dep_file_id, file_name = self.find_file(
-                        addon_id=dep_addon_id, mc_version=self.default_mc_version, file_name_regex=self.file_name_regex)
+                    # the same parameters that resolve the dependency, so changed settings resolve it again
+                    key = config_hash({'dependency': {
+                        'addon_id': dep_addon_id, 'type': self._typ, 'mc_version': self.default_mc_version,
+                        'file_name_regex': self.file_name_regex}})
+                    pin = resolver.pin(key)
+                    if pin:
+                        dep_addon_id, dep_file_id, file_name = pin['addon_id'], pin['file_id'], pin['file_name']
+                    else:
+                        dep_addon_id, dep_file_id, file_name = self.find_file(
+                            addon_id=dep_addon_id, mc_version=self.default_mc_version, file_name_regex=self.file_name_regex)
                     assert dep_addon_id > 0 and dep_file_id > 0, f"dependency resolution error for {dep_type} dependency {dep_addon['name']} {dep_addon['id']} of {addon['name']} {addon['id']}"
                     if dep_addon_id > 0 and dep_file_id > 0:
                         dep_addon = self.get_add_on(dep_addon_id)
-                        dep_entry = {
+                        dep_entry = resolver.add({
                             'addon_id': dep_addon_id,
                             'file_id': dep_file_id,
+                            'file_name': file_name,
                             'name': dep_addon['name'],
                             'type': 'curse',
-                            # 'provides': {str(dep_type): [addon['name']]}, # added by second step
-                        }
-                        entries.append(dep_entry)
+                        }, key=key)
 
                         print(
                             f"added {dep_type} dependency {file_name} \nof {addon['name']}")
 
-            if dep_entry:
-                # merge sides
-                other_side = Side.get(dep_entry.get('side', 'both'))
-                side = Side.get(entry.get('side', 'both'))
-                entry['side'] = str(side | other_side)
-
-                provides = dep_entry.get('provides', {})
-                provide_list = dep_entry.get(str(dep_type), [])
-                provide_list.append(addon['name'])
-                provides[str(dep_type)] = provide_list
-                dep_entry['provides'] = provides
+            resolver.depend(entry, addon['name'], dep_addon['name'], dep_type, dep_entry)
 
     def fill_information(self, entry: dict):
         addon_id = entry['addon_id']
@@ -166,14 +317,16 @@ class CurseProvider(BaseProvider):
             new_list = []
             for provider in provide_list:
                 if isinstance(provider, int):
-                    provide_addon = self.get_add_on(provider)
-                    new_list.append(provide_addon['name'])
+                    provider = self.get_add_on(provider)['name']
+                new_list.append(provider)
             provides[str(release_type)] = new_list
         entry['provides'] = provides
         super().fill_information(entry)
 
     def prepare_download(self, entry: dict, cache_base: Path):
         entry['type'] = 'direct'
+        # published files never change
+        entry['immutable'] = True
 
         if 'cache_base' not in entry:
             entry['cache_base'] = str(cache_base)
@@ -182,75 +335,99 @@ class CurseProvider(BaseProvider):
                 entry['addon_id']), str(entry['file_id'])))
 
     def get_addon_data(self) -> List[Mapping[str, Any]]:
+        """
+        loads the addon catalog from the snapshot in the cache,
+        once it is older than `catalog_ttl` it is revalidated with a conditional request
+        """
+        url = f'{self.meta_url}/api/addon/?mods=1&texturepacks=1&worlds=1&property=id,name,summary,websiteURL,packageType,categorySection.name,categorySection.path'
+        snapshot = self.catalog_snapshot()
+        if snapshot.fresh(self.catalog_ttl):
+            if self.debug:
+                print(f'using catalog snapshot {snapshot.path}')
+            return snapshot.load_json()
+
         if self.debug:
-            print(
-                f'get {self.meta_url}/api/addon/?mods=1&property=id,name,summary,websiteURL,packageType,categorySection.name,categorySection.path')
-        req = requests.get(
-            f'{self.meta_url}/api/addon/?mods=1&texturepacks=1&worlds=1&property=id,name,summary,websiteURL,packageType,categorySection.name,categorySection.path')
-        req.raise_for_status()
-        if req.status_code == 200:
-            addon_data = req.json()
-            return addon_data
-        return None
+            print(f'get {url}')
+        try:
+            req = self.http.get(url, headers=snapshot.validators())
+            if req.status_code == 304:
+                snapshot.touch()
+                return snapshot.load_json()
+            req.raise_for_status()
+        except requests.RequestException as e:
+            if not snapshot.exists():
+                raise
+            print(f'WARNING: failed to refresh the addon catalog, using snapshot from {snapshot.path}: {e}',
+                  file=sys.stderr)
+            return snapshot.load_json()
+        snapshot.store(req.content, req.headers)
+        return req.json()
+
+    def catalog_snapshot(self) -> CachedDocument:
+        return CachedDocument(self.meta_cache_path() / 'catalog.json')
+
+    def meta_cache_path(self) -> Path:
+        """
+        cache directory for metadata of the configured cursemeta instance
+        """
+        meta_host = urlparse(self.meta_url).netloc.replace(':', '_') or 'default'
+        return Path(self.cache_dir, 'meta', 'curse', meta_host)
 
     def get_add_on(self, addon_id: int) -> Dict[str, Any]:
-        addon_files = self.__file_cache.get(id, None)
-        if not addon_files:
-            self.__file_cache[id] = {}
-        addon = next(a for a in self.addon_data if a['id'] == addon_id)
-        return addon
-        if self.debug:
-            print(f'get {self.meta_url}/api/addon/{addon_id}')
-        req = requests.get(f'{self.meta_url}/api/addon/{addon_id}')
-        req.raise_for_status()
-        if req.status_code == 200:
-            addon = req.json()
-            return addon
+        self.load_addon_data()
+        return self._addons_by_id[addon_id]
 
     def get_add_on_file(self, addon_id: int, file_id: int) -> Dict[str, Any]:
-        addon_files = self.__file_cache.get(id, None)
-        if addon_files:
-            file = addon_files.get(file_id, None)
+        # file records do not change once they are published, so any cached copy is good
+        cached = self._file_cache.get(addon_id, ttl=None)
+        if cached:
+            file = cached['files'].get(str(file_id))
             if file:
                 return file
 
         if self.debug:
             print(
                 f'get {self.meta_url}/api/addon/{addon_id}/files/{file_id}')
-        req = requests.get(
+        req = self.http.get(
             f'{self.meta_url}/api/addon/{addon_id}/files/{file_id}'
         )
         req.raise_for_status()
-        if req.status_code == 200:
-            files = req.json()
-            addon_files[file_id] = files
+        file = req.json()
 
-            return file
+        with self._file_lock:
+            cached = self._file_cache.get(addon_id, ttl=None) or {'complete': False, 'files': {}}
+            cached['files'][str(file_id)] = file
+            # keep the age of a complete listing, a single file does not refresh it
+            self._file_cache.put(addon_id, cached, fetched=self._file_cache.fetched(addon_id))
+        return file
 
     def get_add_on_all_files(self, addon_id: int) -> List[Dict[str, Any]]:
-        addon_files = self.__file_cache.get(id, None)
-        if not addon_files:
-            self.__file_cache[id] = {}
-            addon_files = self.__file_cache.get(id, None)
+        cached = self._file_cache.get(addon_id, ttl=self.files_ttl)
+        if cached and cached['complete']:
+            return list(cached['files'].values())
+
         if self.debug:
             print(
                 f'get {self.meta_url}/api/addon/{addon_id}/files')
-        req = requests.get(
+        req = self.http.get(
             f'{self.meta_url}/api/addon/{addon_id}/files'
         )
         req.raise_for_status()
-        if req.status_code == 200:
-            files = req.json()
-            for file in files:
-                addon_files[file['id']] = file
-            return files
+        files = req.json()
+        with self._file_lock:
+            self._file_cache.put(addon_id, {
+                'complete': True,
+                'files': {str(file['id']): file for file in files}
+            })
+        return files
 
     def find_file(self, mc_version: List[str] = None,
                   name: str = None,
                   version: str = None,
                   release_types: List[Any] = list(release_types),
                   addon_id: int = None,
-                  file_name_regex = file_name_regex
+                  file_name_regex = file_name_regex,
+                  quiet: bool = False
                   ) -> Tuple[int, int, str]:
 
         if not release_types:
@@ -261,17 +438,12 @@ class CurseProvider(BaseProvider):
             mc_version = self.default_mc_version
         mc_version = list(mc_version)
 
-        addon = {}
-
-        found = False
-        for addon in self.addon_data:
-            if (name and name == addon['name']) or (addon_id and addon_id == addon['id']):
-                found = True
-                break
+        addon = self.find_add_on(addon_id=addon_id, name=name)
 
         # process addon
-        if not found:
-            print(name or str(addon_id) + ' not found')
+        if not addon:
+            if not quiet:
+                print(f'{name or addon_id} not found')
             return -1, -1, None
 
         addon_id = addon["id"]
@@ -296,7 +468,8 @@ class CurseProvider(BaseProvider):
             # , description
             return addon_id, file['id'], file['fileNameOnDisk']
 
-        print(addon)
-        print(
-            f"no matching version found for: {addon['name']} addon url: {addon['websiteURL']} mc_version: {mc_version} version: {version} ")
+        if not quiet:
+            print(addon)
+            print(
+                f"no matching version found for: {addon['name']} addon url: {addon['websiteURL']} mc_version: {mc_version} version: {version} ")
         return addon_id, -1, ''
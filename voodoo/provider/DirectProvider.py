@@ -1,10 +1,16 @@
-import shutil
+import hashlib
+import os
+import sys
+import time
 from pathlib import Path
-
-import requests
+from typing import Any, Dict, Optional, Tuple
 
 from urllib.parse import urlparse
 
+import requests
+
+from ..cache import HASH_ALGORITHM
+from ..materialize import Materializer
 from .BaseProvider import BaseProvider
 
 __all__ = ['DirectProvider']
@@ -17,6 +23,11 @@ class DirectProvider(BaseProvider):
     # optional = ('file_name',)
     _required_attributes = ('url', 'path', 'package_type')
     _typ = 'direct'
+    _settings_only = ('chunk_size', 'revalidate', 'revalidate_ttl')
+
+    chunk_size = 64 * 1024
+    revalidate = True
+    revalidate_ttl = 60 * 60
 
     def validate(self, entry: dict) -> bool:
         return True
@@ -42,7 +53,7 @@ class DirectProvider(BaseProvider):
             cache_path = Path(entry['cache_base'], url_path.parent, url_path.stem)
             entry['cache_path'] = str(cache_path)
 
-    def download(self, entry: dict, pack_path: Path):
+    def download(self, entry: dict, pack_path: Path, materializer: Materializer) -> str:
         url = entry['url']
         if self.debug:
             print(f'downloading {url}')
@@ -50,32 +61,73 @@ class DirectProvider(BaseProvider):
 
         file_name = entry['file_name']
         file_path = Path(pack_path, entry['file_path'])
-        Path(file_path.parent).mkdir(parents=True, exist_ok=True)
-        url = entry['url']
 
-        # look for files in cache
-        if dep_cache_dir.is_dir():
-            # File is cached
-            cached_files = [f for f in dep_cache_dir.iterdir()]
-            if cached_files:
-                print(f"[{entry['name']}] {cached_files[0].name} (cached)")
-                shutil.copyfile(str(cached_files[0]), str(file_path))
-                return
-
-        # File is not cached and needs to be downloaded
-        file_response = requests.get(url, stream=True)
-        while file_response.is_redirect:
-            source = file_response
-            file_response = requests.get(source, stream=True)
-
-        # write jarfile
-        with open(file_path, "wb") as mod_file:
-            mod_file.write(file_response.content)
-
-        print(f"[{entry['name']}] {file_name} (downloaded)")
-
-        # Try to add file to cache.
-        if not dep_cache_dir.exists():
-            dep_cache_dir.mkdir(parents=True)
-        with open(str(dep_cache_dir / file_name), "wb") as mod_file:
-            mod_file.write(file_response.content)
+        # look for the url in the store, fall back to the per entry cache of older versions
+        record = self.store.lookup(url) or self.adopt_cached(url, dep_cache_dir)
+        status = 'cached'
+        if not record:
+            record, status = self.fetch(url, file_name)
+        elif self.needs_revalidation(entry, record):
+            try:
+                record, status = self.fetch(url, file_name, record)
+            except requests.RequestException as e:
+                # the stored object was verified by `lookup`, it is better than no file
+                print(f'WARNING: failed to revalidate {url}, using the cached file: {e}', file=sys.stderr)
+                status = 'cached, revalidation failed'
+
+        if status == 'downloaded':
+            self.store.miss(url)
+        else:
+            self.store.hit(url)
+        if not materializer.place(self.store.object_path(record['hash']), file_path, record['hash']):
+            status = f'{status}, unchanged'
+
+        return f"[{entry['name']}] {file_name} ({status})"
+
+    def needs_revalidation(self, entry: dict, record: Dict[str, Any]) -> bool:
+        """
+        files of immutable entries (curse files, released maven versions, jenkins builds) never change,
+        other files are revalidated once they were not checked for `revalidate_ttl`
+        """
+        if not self.revalidate or entry.get('immutable') or not self.store.validators(record):
+            return False
+        validated = record.get('validated') or 0
+        return self.revalidate_ttl is None or time.time() - validated >= self.revalidate_ttl
+
+    def adopt_cached(self, url: str, dep_cache_dir: Path) -> Optional[Dict[str, Any]]:
+        if not dep_cache_dir.is_dir():
+            return None
+        cached_files = [f for f in dep_cache_dir.iterdir() if f.is_file() and not f.name.startswith('.')]
+        if not cached_files:
+            return None
+        digest = self.store.add_file(cached_files[0])
+        self.store.record(url, digest)
+        return self.store.lookup(url)
+
+    def fetch(self, url: str, file_name: str, record: Dict[str, Any] = None) -> Tuple[Dict[str, Any], str]:
+        """
+        streams `url` into a temporary file inside the store and commits it under its hash,
+        when `record` is passed the request is conditional and a 304 keeps the stored file
+        """
+        headers = self.store.validators(record) if record else {}
+        with self.http.get(url, stream=True, headers=headers) as response:
+            if record and response.status_code == 304:
+                self.store.validated(url)
+                return record, 'not modified'
+            response.raise_for_status()
+            digest = hashlib.new(HASH_ALGORITHM)
+            fd, temp_name = self.store.temp_file(file_name)
+            try:
+                with os.fdopen(fd, 'wb') as temp_file:
+                    for chunk in self.http.iter_content(response, self.chunk_size):
+                        temp_file.write(chunk)
+                        digest.update(chunk)
+                self.store.commit(Path(temp_name), digest.hexdigest())
+            except BaseException:
+                if os.path.exists(temp_name):
+                    os.unlink(temp_name)
+                raise
+            self.store.record(url, digest.hexdigest(),
+                              etag=response.headers.get('ETag'),
+                              last_modified=response.headers.get('Last-Modified'))
+        return self.store.lookup(url), 'downloaded'
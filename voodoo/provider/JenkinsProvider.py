@@ -3,6 +3,7 @@ from pathlib import Path
 from typing import Dict
 
 from jenkinsapi.jenkins import Jenkins
+from jenkinsapi.utils.requester import Requester
 
 from .BaseProvider import BaseProvider
 
@@ -17,6 +18,7 @@ class JenkinsProvider(BaseProvider):
     # optional = ('build_number', 'file_name_regex')
     _required_attributes = ('jenkins_url', 'job')
     _typ = 'jenkins'
+    _pin_keys = ('build_number',)
 
     __servers: Dict[str, Jenkins] = {}
 
@@ -49,6 +51,8 @@ class JenkinsProvider(BaseProvider):
                 entry['url'] = artifact.url
                 entry['file_name'] = artifact.filename
                 entry['type'] = 'direct'
+                # artifacts of a build never change
+                entry['immutable'] = True
                 break
         if 'cache_base' not in entry:
             entry['cache_base'] = str(cache_base)
@@ -60,6 +64,9 @@ class JenkinsProvider(BaseProvider):
         server = self.__servers.get(url)
         if not server:
             print(f'[{self._typ.upper()}] get server {url}')
-            server = Jenkins(url)
+            requester = Requester(baseurl=url, timeout=self.http.timeout)
+            # reuse the pooled connections of the shared client
+            requester.session = self.http.session
+            server = Jenkins(url, requester=requester)
             self.__servers[url] = server
         return server
@@ -1,7 +1,7 @@
 import os
-import shutil
 from pathlib import Path
 
+from ..materialize import Materializer
 from .BaseProvider import BaseProvider
 
 __all__ = ['LocalProvider']
@@ -34,15 +34,16 @@ class LocalProvider(BaseProvider):
         # TODO: check if file exists
         return True
 
-    def write_direct_url(self, entry: dict, src_path: Path):
+    def write_direct_url(self, entry: dict, src_path: Path, materializer: Materializer):
         pass
 
-    def download(self, entry: dict, pack_path: Path):
+    def download(self, entry: dict, pack_path: Path, materializer: Materializer) -> str:
         file_path = Path(entry['file'])
         if(not os.path.isabs(file_path)):
             file_path = Path(pack_path, self.local_base, entry['file']).resolve()
         file_name = entry.get('file_name', file_path.name)
         path = Path(pack_path, entry['path']).resolve()
         path = path / file_name
-        shutil.copyfile(str(file_path), str(path))
-        print(f"copied {file_name}")
+        if materializer.place(file_path, path):
+            return f"copied {file_name}"
+        return f"unchanged {file_name}"
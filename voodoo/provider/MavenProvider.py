@@ -1,9 +1,16 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from urllib.parse import quote, unquote, urljoin, urlparse, urlunsplit
+from threading import RLock
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
 
 import requests
-import xmltodict
+import simplejson as json
 
+from ..cache import CachedDocument
+from ..maven import MavenMetadata
 from .BaseProvider import BaseProvider
 
 __all__ = ['MavenProvider']
@@ -14,34 +21,111 @@ class MavenProvider(BaseProvider):
         'remote_repository', 'group', 'artifact', 'version', 'path', 'package_type'
     )
     _typ = 'mvn'
+    _pin_keys = ('version',)
+    _settings_only = ('metadata_ttl', 'missing_ttl', 'prefetch_workers')
 
-    def prepare_dependencies(self, entry: dict):
+    # loaded metadata by url, `None` for missing artifacts, shared by all packs built in this process
+    __metadata: Dict[str, Tuple[float, Optional[MavenMetadata]]] = {}
+    _metadata_lock = RLock()
+
+    metadata_ttl = 60 * 60
+    missing_ttl = 10 * 60
+    prefetch_workers = 8
+
+    @staticmethod
+    def metadata_url(entry: dict) -> str:
         remote_repository = entry.get('remote_repository')
         if not remote_repository[-1] == '/':
             remote_repository += '/'
-        group = entry.get('group').replace('.', '/')
+        path = '/'.join([*entry.get('group').split('.'), entry.get('artifact'), 'maven-metadata.xml'])
+        return urljoin(remote_repository, path)
+
+    def metadata_snapshot(self, url: str) -> CachedDocument:
+        parsed = urlparse(url)
+        host = parsed.netloc.replace(':', '_') or 'default'
+        path = Path(self.cache_dir, 'meta', 'mvn', host, *parsed.path.strip('/').split('/'))
+        return CachedDocument(path.with_suffix('.json'))
+
+    def get_metadata(self, url: str) -> Optional[MavenMetadata]:
+        """
+        metadata of the artifact at `url` or `None` if the repository does not have it
+
+        the metadata is cached and revalidated with a conditional request once it is older than `metadata_ttl`,
+        missing artifacts are asked for again after `missing_ttl`
+        """
+        with self._metadata_lock:
+            known = self.__metadata.get(url)
+        if known:
+            loaded, metadata = known
+            ttl = self.metadata_ttl if metadata else self.missing_ttl
+            if ttl is not None and time.time() - loaded < ttl:
+                return metadata
+        metadata = self.load_metadata(url)
+        with self._metadata_lock:
+            self.__metadata[url] = (time.time(), metadata)
+        return metadata
+
+    def load_metadata(self, url: str) -> Optional[MavenMetadata]:
+        snapshot = self.metadata_snapshot(url)
+        missing = snapshot.meta.get('missing')
+        if snapshot.fresh(self.missing_ttl if missing else self.metadata_ttl):
+            if self.debug:
+                print(f'using maven metadata {snapshot.path}')
+            return None if missing else MavenMetadata.from_json(snapshot.load_json())
+
+        if self.debug:
+            print(f'get {url}')
+        try:
+            response = self.http.get(url, headers=snapshot.validators())
+            if response.status_code == 304:
+                snapshot.touch()
+                return MavenMetadata.from_json(snapshot.load_json())
+            if response.status_code in (404, 410):
+                snapshot.store(b'null', missing=True)
+                return None
+            response.raise_for_status()
+        except requests.RequestException as e:
+            if not snapshot.exists() or missing:
+                raise
+            print(f'WARNING: failed to refresh {url}, using snapshot from {snapshot.path}: {e}', file=sys.stderr)
+            return MavenMetadata.from_json(snapshot.load_json())
+        metadata = MavenMetadata.from_xml(response.content)
+        # only the parsed versions are kept, the validators belong to the xml
+        snapshot.store(json.dumps(metadata.to_json()).encode(), response.headers)
+        return metadata
+
+    def prefetch(self, entries: List[dict]):
+        """
+        loads the metadata of all artifacts with `prefetch_workers` requests in parallel
+        """
+        urls = {self.metadata_url(entry) for entry in entries}
+        if len(urls) < 2:
+            return
+
+        def load(url: str):
+            try:
+                self.get_metadata(url)
+            except requests.RequestException as e:
+                # resolving runs into the same error and reports it properly
+                if self.debug:
+                    print(f'prefetch failed: {e}')
+
+        with ThreadPoolExecutor(max_workers=self.prefetch_workers) as executor:
+            list(executor.map(load, urls))
+
+    def prepare_dependencies(self, entry: dict):
         artifact = entry.get('artifact')
         version = str(entry.get('version', 'release'))
-        path = '/'.join([*group.split('.'), artifact, 'maven-metadata.xml'])
-        url = urljoin(remote_repository, path)
-        response = requests.get(url)
-        response.raise_for_status()
-        meta = xmltodict.parse(response.content)
+        url = self.metadata_url(entry)
+        metadata = self.get_metadata(url)
+        assert metadata, f'{artifact} not found in {entry.get("remote_repository")}'
+        resolved = metadata.find_version(version)
         if version == 'release':
-            version = meta['metadata']['versioning'].get('release')
-            if not version:
-                version = meta['metadata'].get('version')
-            assert version, f'no release or default version could be found for {artifact}'
+            assert resolved, f'no release or default version could be found for {artifact}'
         else:
-            versions = meta['metadata']['versioning']['versions']['version']
-            # filter versions # TODO: regex
-            versions = [v for v in versions if version in v]
-            assert versions, f'{version} not found in {url}'
-            version = sorted(versions)[-1]
-            print(versions)
-            print(version)
-        entry['version'] = version
-        print(f'{artifact} version is {version}')
+            assert resolved, f'{version} not found in {url}'
+        entry['version'] = resolved
+        print(f'{artifact} version is {resolved}')
 
     def validate(self, entry: dict) -> bool:
         # TDOD: check if version was found
@@ -65,6 +149,8 @@ class MavenProvider(BaseProvider):
         entry['type'] = 'direct'
         entry['url'] = url
         entry['file_name'] = file_name
+        # released versions never change, snapshots are replaced
+        entry['immutable'] = not version.endswith('-SNAPSHOT')
 
         if 'cache_base' not in entry:
             entry['cache_base'] = str(cache_base)
@@ -0,0 +1,50 @@
+import importlib
+from typing import Any, Dict, Optional, Type
+
+from ..profiling import Profiler
+from .BaseProvider import BaseProvider
+
+__all__ = ['ProviderMap']
+
+
+class ProviderMap(dict):
+    """
+    providers by type, every provider is created the first time its type is needed
+
+    `registry` maps the types to their classes as `module:class`, the module is imported on first use.
+    `provider_args` are passed to every provider, entries are matched
+    against the providers in the order of `registry`
+    """
+
+    def __init__(self, registry: Dict[str, str], provider_args: Dict[str, Any], profiler: Profiler = None):
+        super().__init__()
+        self.registry = registry
+        self.provider_args = provider_args
+        self.profiler = profiler or Profiler()
+
+    def provider_class(self, typ: str) -> Type[BaseProvider]:
+        module_name, class_name = self.registry[typ].split(':')
+        return getattr(importlib.import_module(module_name), class_name)
+
+    def __missing__(self, typ: str) -> BaseProvider:
+        with self.profiler.phase('init_providers', typ):
+            provider = self.provider_class(typ)(**self.provider_args)
+        self[typ] = provider
+        return provider
+
+    def find_matching(self, entry: Any) -> Optional[BaseProvider]:
+        """
+        entries with a `type` only create their own provider,
+        other entries are tried on the providers in order
+        """
+        typ = entry.get('type') if isinstance(entry, dict) else None
+        if typ:
+            if typ not in self.registry:
+                return None
+            provider = self[typ]
+            return provider if provider.match(entry) else None
+        for typ in self.registry:
+            provider = self[typ]
+            if provider.match(entry):
+                return provider
+        return None
@@ -1,10 +1,29 @@
 #!/bin/python3
 # -*- coding: utf-8 -*-
 
+from collections import OrderedDict
+from typing import Dict
+
 from .BaseProvider import BaseProvider
-from .CurseProvider import CurseProvider
-from .DirectProvider import DirectProvider
-from .GithubProvider import GithubProvider
-from .JenkinsProvider import JenkinsProvider
-from .LocalProvider import LocalProvider
-from .MavenProvider import MavenProvider
+from .ProviderMap import ProviderMap
+
+__all__ = ['BaseProvider', 'ProviderMap', 'provider_registry', 'register_provider']
+
+# provider type -> `module:class`, entries are matched against the providers in this order
+# a provider module and its dependencies are only imported when a pack uses that type
+provider_registry: Dict[str, str] = OrderedDict([
+    ('curse', 'voodoo.provider.CurseProvider:CurseProvider'),
+    ('direct', 'voodoo.provider.DirectProvider:DirectProvider'),
+    ('local', 'voodoo.provider.LocalProvider:LocalProvider'),
+    ('mvn', 'voodoo.provider.MavenProvider:MavenProvider'),
+    ('github', 'voodoo.provider.GithubProvider:GithubProvider'),
+    ('jenkins', 'voodoo.provider.JenkinsProvider:JenkinsProvider'),
+])
+
+
+def register_provider(typ: str, target: str):
+    """
+    registers the provider class `target` (`module:class`) for `typ`, replacing a registered provider
+    """
+    provider_registry[typ] = target
+
@@ -0,0 +1,245 @@
+import sys
+from collections import deque
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from .cftypes import DependencyType, Side
+from .entry import Entry, EntryRegistry
+
+if TYPE_CHECKING:
+    # providers import the resolvers
+    from .provider.BaseProvider import BaseProvider
+
+__all__ = ['DependencyResolver', 'FeatureResolver']
+
+
+class DependencyResolver:
+    """
+    resolves the dependencies of all entries with a worklist over the dependency graph
+
+    providers look up existing entries with `find`, add missing ones with `add`
+    and record edges with `depend`, added entries are queued and resolved as well.
+    `pins` are the versions of dependencies added in an earlier run by their key,
+    providers reuse them with `pin` instead of resolving the dependency again.
+    afterwards sides are propagated from dependents to their dependencies
+    and cycles are reported
+    """
+
+    # dependencies that have to be installed on the same side as their dependent
+    side_dependencies = (DependencyType.Required, DependencyType.Optional)
+
+    def __init__(self, entries: EntryRegistry, debug: bool = False, pins: Dict[str, dict] = None):
+        self.entries = entries
+        self.debug = debug
+        self.pins = pins or {}
+        # pin keys of added dependencies by entry id
+        self.keys: Dict[int, str] = {}
+        self._edges: Dict[int, List[tuple]] = {}
+        self._added = set()
+        self._queue = deque()
+        self._queue.extend(entries)
+
+    def find(self, name: str = None, addon_id: int = None) -> Optional[Entry]:
+        entry = None
+        if addon_id is not None:
+            entry = self.entries.by_addon_id(addon_id)
+        if entry is None and name is not None:
+            entry = self.entries.by_name(name)
+        return entry
+
+    def pin(self, key: str) -> Optional[dict]:
+        return self.pins.get(key)
+
+    def add(self, entry: dict, key: str = None) -> Entry:
+        """
+        adds a new dependency entry, it is resolved later in the same run
+        its resolved version is pinned by `key`
+        """
+        entry = self.entries.add(entry)
+        self._added.add(id(entry))
+        if key is not None:
+            self.keys[id(entry)] = key
+        self._queue.append(entry)
+        return entry
+
+    def depend(self, entry: dict, name: str, dep_name: str, dep_type: DependencyType, dep_entry: dict = None):
+        """
+        records that `entry` (called `name`) depends on `dep_name`,
+        when the dependency is part of the pack it provides `name`
+        """
+        depends = entry.setdefault('depends', {})
+        depends.setdefault(str(dep_type), []).append(dep_name)
+        if dep_entry is None:
+            return
+        provides = dep_entry.setdefault('provides', {})
+        provides.setdefault(str(dep_type), []).append(name)
+        self._edges.setdefault(id(entry), []).append((dep_entry, dep_type))
+
+    def resolve(self, provider_map: Dict[str, 'BaseProvider']):
+        while self._queue:
+            entry = self._queue.popleft()
+            provider_map[entry['type']].resolve_dependencies(entry, self)
+        self.propagate_sides()
+        self.check_cycles()
+
+    def propagate_sides(self):
+        """
+        every dependency is installed on all sides of its dependents,
+        added dependencies are installed only where they are needed
+        """
+        sides = {}
+        for entry in self.entries:
+            if id(entry) in self._added:
+                sides[id(entry)] = 0
+            else:
+                sides[id(entry)] = int(Side.get(entry.get('side') or 'both'))
+        changed = {id(e): False for e in self.entries}
+        queue = deque(self.entries)
+        while queue:
+            entry = queue.popleft()
+            side = sides[id(entry)]
+            for dep_entry, dep_type in self._edges.get(id(entry), ()):
+                if dep_type not in self.side_dependencies:
+                    continue
+                dep_side = sides[id(dep_entry)]
+                if dep_side | side != dep_side:
+                    sides[id(dep_entry)] = dep_side | side
+                    changed[id(dep_entry)] = True
+                    queue.append(dep_entry)
+        for entry in self.entries:
+            if changed[id(entry)] and sides[id(entry)]:
+                entry['side'] = str(Side(sides[id(entry)]))
+                if self.debug:
+                    print(f"{entry.get('name')} side is {entry['side']}")
+
+    def check_cycles(self) -> List[List[str]]:
+        """
+        reports dependency cycles, they are resolved anyways since every entry is only added once
+        """
+        white, grey, black = 0, 1, 2
+        color = {id(e): white for e in self.entries}
+        cycles = []
+        for root in self.entries:
+            if color[id(root)] != white:
+                continue
+            path = [root]
+            stack = [iter(self._edges.get(id(root), ()))]
+            color[id(root)] = grey
+            while stack:
+                edge = next(stack[-1], None)
+                if edge is None:
+                    stack.pop()
+                    color[id(path.pop())] = black
+                    continue
+                dep_entry = edge[0]
+                if color[id(dep_entry)] == grey:
+                    start = next(i for i, e in enumerate(path) if e is dep_entry)
+                    cycle = [e.get('name') or str(e.get('addon_id')) for e in path[start:]]
+                    cycle.append(cycle[0])
+                    cycles.append(cycle)
+                    print(f"WARNING: dependency cycle {' -> '.join(cycle)}", file=sys.stderr)
+                elif color[id(dep_entry)] == white:
+                    color[id(dep_entry)] = grey
+                    path.append(dep_entry)
+                    stack.append(iter(self._edges.get(id(dep_entry), ())))
+        return cycles
+
+
+class FeatureResolver:
+    """
+    collects optional features with all entries they depend on
+
+    the dependency closure of every entry is computed once over an adjacency map
+    and shared between all features that include it
+    """
+
+    def __init__(self, entries: EntryRegistry, debug: bool = False):
+        self.debug = debug
+        self.features: List[dict] = []
+        self._features: Dict[str, dict] = {}
+        # only dependencies that are part of the pack
+        names = entries.names()
+        self._adjacency: Dict[str, List[str]] = {}
+        for entry in entries:
+            name = entry.get('name')
+            if name is None or name in self._adjacency:
+                continue
+            depends = entry.get('depends') or {}
+            self._adjacency[name] = [d for deps in depends.values() for d in deps if d in names]
+        self._closures: Dict[str, List[str]] = {}
+
+    def get(self, name: str) -> Optional[dict]:
+        return self._features.get(name)
+
+    def closure(self, name: str) -> List[str]:
+        """
+        `name` and all its transitive dependencies
+
+        a depth first walk stores the closure of every entry it finishes,
+        so dependencies shared by several features are only walked once.
+        entries of a dependency cycle share their closure
+        """
+        cached = self._closures.get(name)
+        if cached is not None:
+            return cached
+        # iterative tarjan, closures are complete once the strongly connected component of an entry is finished
+        index: Dict[str, int] = {name: 0}
+        low: Dict[str, int] = {name: 0}
+        component_stack = [name]
+        on_stack = {name}
+        stack = [(name, iter(self._adjacency.get(name, ())))]
+        while stack:
+            current, deps = stack[-1]
+            for dep in deps:
+                if dep in self._closures:
+                    continue
+                if dep not in index:
+                    index[dep] = low[dep] = len(index)
+                    component_stack.append(dep)
+                    on_stack.add(dep)
+                    stack.append((dep, iter(self._adjacency.get(dep, ()))))
+                    break
+                if dep in on_stack:
+                    low[current] = min(low[current], index[dep])
+            else:
+                stack.pop()
+                if stack:
+                    parent = stack[-1][0]
+                    low[parent] = min(low[parent], low[current])
+                if low[current] == index[current]:
+                    component = []
+                    while True:
+                        member = component_stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == current:
+                            break
+                    self._finish_component(component[::-1])
+        return self._closures[name]
+
+    def _finish_component(self, component: List[str]):
+        members = set(component)
+        reachable = list(component)
+        for member in component:
+            for dep in self._adjacency.get(member, ()):
+                if dep not in members:
+                    reachable.extend(self._closures[dep])
+        for member in component:
+            seen = {member}
+            closure = [member]
+            for other in reachable:
+                if other not in seen:
+                    seen.add(other)
+                    closure.append(other)
+            self._closures[member] = closure
+
+    def add(self, feature_name: str, entry_name: str) -> dict:
+        feature = {
+            'name': feature_name,
+            'names': [feature_name],
+            'entry_refs': list(self.closure(entry_name)),
+        }
+        if self.debug:
+            print(f'feature {feature_name}: {feature["entry_refs"]}')
+        self.features.append(feature)
+        self._features[feature_name] = feature
+        return feature
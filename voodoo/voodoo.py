@@ -1,33 +1,78 @@
 #!/bin/python3
 # -*- coding: utf-8 -*-
 import argparse
+import copy
 import io
 import sys
+import time
 import traceback
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from itertools import groupby
 from pathlib import Path
-from shutil import rmtree
-from typing import Any, Dict, List, Tuple
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
 
 import appdirs
-import pkg_resources
-import requests
 import ruamel.yaml as yaml
 import simplejson as json
 from ruamel.yaml.error import ReusedAnchorWarning
 
+from .cache import CachedDocument, CacheManager, ContentStore, format_size
+from .config import ConfigError, ConfigLoader
 from .cftypes import DependencyType, RLType
 from .dependency_graph import generate_graph
-from .provider import *
+from .entry import Entry, EntryRegistry
+from .forge import ForgeIndex
+from .download import DownloadEngine
+from .lockfile import Lockfile, config_hash
+from .materialize import Materializer
+from .profiling import Profiler
+from .resolver import DependencyResolver, FeatureResolver
+from .watch import FileWatcher
+from .provider import BaseProvider, ProviderMap, provider_registry
 
 warnings.simplefilter("ignore", ReusedAnchorWarning)
 
+# bundled default configs
+DATA_PATH = Path(__file__).resolve().parent / 'data'
+
+
+COMMANDS = ('cache', 'watch')
+
+
+def pack_exists(name: str, argv: List[str]) -> bool:
+    """
+    checks for a pack called `name` the way `find_pack_config` would find it, using the packs directory of `--config`
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('-c', '--config', default='config/config.yaml')
+    args, _ = parser.parse_known_args(argv)
+    cache_dir = appdirs.AppDirs(appname='voodoo', appauthor='nikky').user_cache_dir
+    config_loader = ConfigLoader(Path(DATA_PATH, 'default.yaml'), Path(args.config), cache_path=Path(cache_dir, 'config'))
+    try:
+        packs = config_loader.global_config().get('packs')
+    except (yaml.YAMLError, ConfigError):
+        # a pack can not be built with a broken config either
+        return False
+    packs_path = Path(Path(args.config).parent, packs)
+    return any(p.is_file() for p in (Path(name), Path(f'{name}.yaml'), packs_path / name, packs_path / f'{name}.yaml'))
+
 
 def main():  # TODO: move to __main__ ?
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command in COMMANDS:
+        if pack_exists(command, sys.argv[2:]):
+            print(f'building pack {command}, rename it to use `voodoo {command}`')
+        elif command == 'cache':
+            return cache_main(sys.argv[2:])
+        else:
+            return watch_main(sys.argv[2:])
     parser = argparse.ArgumentParser(
         description='Download mods from curseforge and other sources')
-    parser.add_argument('pack', help='pack definition file')
+    parser.add_argument('pack', nargs='*',
+                        help='pack definition files or directories of them, several packs are built in one process')
     parser.add_argument(
         '-c', '--config', default='config/config.yaml', help='config file')
     # parser.add_argument('--auth', help='auth file for github login')
@@ -37,20 +82,192 @@ def main():  # TODO: move to __main__ ?
                         action='store_true', help='display debug info')
     parser.add_argument('--export', dest='export',
                         action='store_true', help='export into new format, look in data directory for exported pack')
+    parser.add_argument('--update', dest='update',
+                        action='store_true', help='ignore the lockfile and resolve all entries again')
+    parser.add_argument('--profile', dest='profile',
+                        action='store_true', help='time all phases and write profile.json next to modpack.json')
+    parser.add_argument('--all', dest='all',
+                        action='store_true', help='build all packs in the packs directory')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                        help='number of packs that are built in parallel')
     args, unknown = parser.parse_known_args()
     args = vars(args)
-
-    voodoo = Voodoo(**args)
-    voodoo.process_pack()
+    build_all = args.pop('all')
+    jobs = args.pop('jobs')
+    packs = []
+    for pack in args.pop('pack'):
+        if Path(pack).is_dir():
+            packs.extend(str(p) for p in sorted(Path(pack).glob('*.yaml')))
+        else:
+            packs.append(pack)
+    if not packs and not build_all:
+        parser.error('no pack given, pass pack files, directories or --all')
+
+    voodoo = Voodoo(pack=None, **args)
+    if build_all:
+        packs.extend(str(p) for p in voodoo.find_packs())
+    if len(packs) == 1:
+        voodoo.pack = packs[0]
+        voodoo.process_pack()
+    else:
+        failed = voodoo.process_packs(packs, jobs=jobs)
+        if failed:
+            exit(1)
+
+
+def cache_main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(
+        prog='voodoo cache', description='Inspect and maintain the download cache')
+    parser.add_argument('action', choices=('stats', 'prune', 'verify'),
+                        help='stats: show size and hit rate, prune: evict files over the budget, verify: rehash all files')
+    parser.add_argument(
+        '-c', '--config', default='config/config.yaml', help='config file')
+    parser.add_argument('--max-size', dest='max_size',
+                        help='size budget like 500M or 10G, overrides cache_max_size')
+    parser.add_argument('--debug', dest='debug',
+                        action='store_true', help='display debug info')
+    args = parser.parse_args(argv)
+
+    voodoo = Voodoo(config=args.config, debug=args.debug, pack=None, export=False)
+    cache = voodoo.cache
+
+    if args.action == 'prune':
+        removed, freed = cache.prune(args.max_size)
+        print(f'removed {removed} files, freed {format_size(freed)}')
+    elif args.action == 'verify':
+        broken = cache.verify()
+        print(f'{len(broken)} damaged files removed')
+
+    stats = cache.stats()
+    max_size = stats['max_size']
+    hit_rate = stats['hit_rate']
+    print(f"cache: {stats['path']}")
+    print(f"size: {format_size(stats['size'])} / {format_size(max_size) if max_size else 'unlimited'} "
+          f"in {stats['files']} files for {stats['urls']} urls")
+    print(f"hits: {stats['hits']} misses: {stats['misses']} "
+          f"hit rate: {f'{hit_rate:.1%}' if hit_rate is not None else '-'}")
+    print(f"evicted: {stats['evictions']} files, {format_size(stats['evicted_bytes'])}")
+
+
+def watch_main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(
+        prog='voodoo watch', description='Rebuild packs whenever their config changes')
+    parser.add_argument('pack', nargs='*', help='pack definition files')
+    parser.add_argument(
+        '-c', '--config', default='config/config.yaml', help='config file')
+    parser.add_argument('--all', dest='all',
+                        action='store_true', help='watch all packs in the packs directory, including new ones')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='seconds between checks for changes')
+    parser.add_argument('--debug', dest='debug',
+                        action='store_true', help='display debug info')
+    parser.add_argument('--profile', dest='profile',
+                        action='store_true', help='time all phases and write profile.json next to modpack.json')
+    args = parser.parse_args(argv)
+    if not args.pack and not args.all:
+        parser.error('no pack given, pass pack files or --all')
+
+    config_path = Path(args.config)
+    watcher = FileWatcher([config_path])
+
+    def load() -> Voodoo:
+        return Voodoo(config=args.config, debug=args.debug, pack=None, export=False, profile=args.profile)
+
+    voodoo = load()
+    packs: Dict[Path, str] = {}
+    # pack files and the files they include -> packs using them
+    dependents: Dict[Path, List[str]] = {}
+
+    def add_packs(names: Iterable[str]) -> List[str]:
+        new = []
+        for name in names:
+            path = voodoo.find_pack_config(name)
+            if path and path.resolve() not in packs:
+                packs[path.resolve()] = str(path)
+                watcher.add(path)
+                new.append(str(path))
+        return new
+
+    def build(rebuild: List[str]):
+        voodoo.process_packs(rebuild)
+        dependents.clear()
+        for path, name in packs.items():
+            for dependency in voodoo.config_loader.dependencies(path):
+                watcher.add(dependency)
+                dependents.setdefault(dependency, []).append(name)
+
+    # providers, the curse catalog, forge data and http connections stay loaded between builds
+    names = list(args.pack)
+    if args.all:
+        names.extend(str(p) for p in voodoo.find_packs())
+    build(add_packs(names))
+    print(f'watching {len(packs)} packs and {config_path}, press Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(args.interval)
+            changed = watcher.poll()
+            if config_path.resolve() in changed:
+                try:
+                    voodoo = load()
+                except (yaml.YAMLError, ConfigError) as e:
+                    # keep watching with the previous config until the error is fixed
+                    print(f'failed to load {config_path}, keeping the previous config: {e}', file=sys.stderr)
+                    continue
+                print(f'{config_path} changed, rebuilding all packs')
+                rebuild = list(packs.values())
+            else:
+                rebuild = []
+                for path in changed:
+                    rebuild.extend(p for p in dependents.get(path, [packs.get(path)]) if p and p not in rebuild)
+            if args.all:
+                rebuild.extend(p for p in add_packs(str(p) for p in voodoo.find_packs()) if p not in rebuild)
+            if rebuild:
+                build(rebuild)
+                print(f'watching {len(packs)} packs and {config_path}')
+    except KeyboardInterrupt:
+        print('stopped watching')
+
+
+def dump_entries(entries: Iterable[Entry]) -> str:
+    """
+    entries as yaml for debug output
+    """
+    return yaml.dump([dict(entry) for entry in entries])
+
+
+def assert_dict(check_name: str, keys: Tuple[str], entries: List[dict]):
+    fail = False
+    all_missing = {}
+    for entry in entries:
+        missing = set(keys) - set(entry.keys())
+        if missing:
+            print(
+                f"[{check_name}] missing {', '.join(missing)} from \n\t{entry}", file=sys.stderr)
+            fail = True
+            entry_id = entry.get('name') or entry.get(
+                'url') or str(entry)
+            all_missing[entry_id] = missing
+    assert not fail, f'{check_name} missing values {all_missing}'
+    # raise KeyError(all_missing)
 
 
 class Voodoo:
-    forge_data = None
+    # forge indexes by url, shared by all packs built in this process
+    forge_indexes: Dict[str, ForgeIndex] = {}
+    _forge_lock = Lock()
+    forge_url = 'http://files.minecraftforge.net/maven/net/minecraftforge/forge/json'
+    forge_ttl = 60 * 60
     sponge_entry = None
+    # batch builds prune the cache once after all packs are done
+    prune_cache = True
+    _workspace_lock = Lock()
 
-    def __init__(self, config, debug, pack, export):
+    def __init__(self, config, debug, pack, export, update=False, profile=False):
         self.debug = debug
         self.export = export
+        self.update = update
+        self.profile = profile
+        self.profiler = Profiler(enabled=False)
         if self.debug:
             print('using encoding {}'.format(sys.stdout.encoding))
         self.config_path = Path(config).resolve()
@@ -58,6 +275,7 @@ class Voodoo:
 
         self.cache_dir = appdirs.AppDirs(
             appname='voodoo', appauthor='nikky').user_cache_dir
+        self.store = ContentStore(Path(self.cache_dir, 'store'), debug=self.debug)
 
         # parse config
         config_dir = self.config_path.parent
@@ -66,22 +284,9 @@ class Voodoo:
         config_suffix = self.config_path.suffix
         if config_suffix == '.yaml':
             config_dir.mkdir(parents=True, exist_ok=True)
-            output = io.StringIO()
-
-            default_config = pkg_resources.resource_string(__name__, 'data/default.yaml').decode()
-            output.write(default_config)
-            
-            output.write('\n# END DEFAULTS\n\n# BEGIN CONFIG\n\n')
-            if self.config_path.exists():
-                with open(self.config_path, 'w') as outfile:
-                    outfile.write(default_config)
-                with open(self.config_path) as infile:
-                    output.write(infile.read())
-
-            self.config_str = output.getvalue()
-            output.close()
-
-            self.global_config = yaml.safe_load(self.config_str)
+            self.config_loader = ConfigLoader(Path(DATA_PATH, 'default.yaml'), self.config_path,
+                                              cache_path=Path(self.cache_dir, 'config'), debug=self.debug)
+            self.global_config = self.config_loader.global_config()
             if self.debug:
                 print(yaml.dump(self.global_config))
             self.config_path = config_dir
@@ -91,63 +296,125 @@ class Voodoo:
                 temp_path.mkdir(parents=True, exist_ok=True)
                 temp_path = Path(temp_path, 'generated_config.yaml')
                 with open(temp_path, 'w') as outfile:
-                    outfile.write(self.config_str)
+                    outfile.write(self.config_loader.base_text())
         else:
             print('requires yaml config file')
             exit(-1)
 
+        self.cache = CacheManager(self.cache_dir, self.store,
+                                  max_size=self.global_config.get('cache_max_size'))
+        # requests is only imported when voodoo actually does something
+        from .http_client import HttpClient
+        self.http = HttpClient(**(self.global_config.get('http') or {}))
+
         # auth_file = args.auth or config.get('authentication', None)
         # auth = config.get('authentication', {})
         # if args.username_github and args.password_github:
         #     auth_github = {'username': args.username, 'password': args.password}
         #     auth['github'] = auth_github
 
-    def process_pack(self):
-        pack_base = self.pack
-        print(f'processing {pack_base}')
-
-        pack_config_path = Path(self.pack)
+    def process_packs(self, packs: List[str], jobs: int = 1) -> List[str]:
+        """
+        builds several packs in this process, they share the http client, the caches
+        and everything providers and forge loaded, with `jobs` > 1 packs are built in parallel
+        returns the packs that failed
+        """
+        def build(pack: str):
+            voodoo = copy.copy(self)
+            voodoo.pack = pack
+            voodoo.prune_cache = False
+            voodoo.process_pack()
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            futures = [(pack, executor.submit(build, pack)) for pack in packs]
+            for pack, future in futures:
+                try:
+                    future.result()
+                except (Exception, SystemExit) as e:
+                    print(f'ERROR: building {pack} failed: {e!r}', file=sys.stderr)
+                    if self.debug:
+                        traceback.print_exception(type(e), e, e.__traceback__)
+                    failed.append(pack)
+
+        removed, freed = self.cache.prune()
+        if removed:
+            print(f'evicted {removed} files ({format_size(freed)}) from the cache')
+        print(f'built {len(packs) - len(failed)} of {len(packs)} packs')
+        for pack in failed:
+            print(f'  failed: {pack}')
+        return failed
+
+    def find_packs(self) -> List[Path]:
+        """
+        all packs in the `packs` directory of the config, except abstract packs that are only included
+        """
+        packs_path = Path(self.config_path, self.global_config.get('packs'))
+        packs = []
+        for path in sorted(packs_path.glob('*.yaml')):
+            try:
+                if self.config_loader.is_abstract(path):
+                    if self.debug:
+                        print(f'skipping abstract pack {path}')
+                    continue
+            except (yaml.YAMLError, ConfigError):
+                # building the pack reports the error
+                pass
+            packs.append(path)
+        return packs
+
+    def find_pack_config(self, pack: str) -> Optional[Path]:
+        """
+        looks for `pack` as a file, with `.yaml` appended and in the packs directory
+        """
+        pack_config_path = Path(pack)
 
         if not pack_config_path.is_file():
             print(f"no such file: {pack_config_path}")
-            pack_config_path = Path(f"{self.pack}.yaml")
+            pack_config_path = Path(f"{pack}.yaml")
 
         if not pack_config_path.is_absolute():
             if not pack_config_path.is_file():
                 print(f"no such file: {pack_config_path}")
                 pack_config_base = Path(self.config_path, self.global_config.get('packs'))
-                pack_config_path = pack_config_base / self.pack
+                pack_config_path = pack_config_base / pack
 
             if not pack_config_path.is_file():
                 print(f"no such file: {pack_config_path}")
                 pack_config_base = Path(self.config_path, self.global_config.get('packs'))
-                pack_config_path = pack_config_base / f"{self.pack}.yaml"
+                pack_config_path = pack_config_base / f"{pack}.yaml"
 
         if not pack_config_path.is_file():
             print(f"no such file: {pack_config_path}")
+            return None
+        return pack_config_path
+
+    def process_pack(self):
+        pack_base = self.pack
+        print(f'processing {pack_base}')
+        profiler = self.profiler = Profiler(enabled=self.profile)
+        http_snapshot = self.http.snapshot()
+        cache_snapshot = self.store.load_stats()
+
+        pack_config_path = self.find_pack_config(self.pack)
+        if not pack_config_path:
             exit(-1)
-        else:
-            print(f"found: {pack_config_path}")
+        print(f"found: {pack_config_path}")
+        # batch and watch builds pass paths, generated files are named after the pack file
+        pack_base = pack_config_path.stem
 
         if self.export:
             self.exPort(pack_config_path, pack_base)
 
-        output = io.StringIO()
-        output.write(self.config_str)
-        output.write('\n# END DEFAULTS\n\n# BEGIN CONFIG\n\n')
-        with open(pack_config_path) as infile:
-            output.write(infile.read())
-        config_str = output.getvalue()
-        output.close()
         try:
-            pack_config = yaml.safe_load(config_str)
-        except yaml.YAMLError as exc:
+            pack_config = self.config_loader.load_pack(pack_config_path)
+        except (yaml.YAMLError, ConfigError) as exc:
             print('failed loading yaml')
             temp_path = Path(self.config_path, 'fail')
             temp_path.mkdir(parents=True, exist_ok=True)
             temp_path = temp_path / f'{pack_base}.yaml'
             with open(temp_path, 'w') as outfile:
-                outfile.write(config_str)
+                outfile.write(self.config_loader.pack_text(pack_config_path))
             print(
                 f'written failing yaml to {temp_path} \nfailed parsing config {exc}')
             exit(-1)
@@ -159,7 +426,7 @@ class Voodoo:
             temp_path.mkdir(parents=True, exist_ok=True)
             merged_config_path = temp_path / f'{pack_base}.yaml'
             with open(merged_config_path, 'w') as outfile:
-                outfile.write(config_str)
+                yaml.dump(pack_config, outfile, default_flow_style=False)
 
         output_path = Path(pack_config.get('output') or 'modpacks', pack_config.get('name'))
         data_path = Path(pack_config.get('data_path', 'data'))
@@ -176,147 +443,72 @@ class Voodoo:
         mc_version = [str(v) for v in mc_version]
         assert mc_version, 'no Minecraft version defined'
         forge_version = pack_config.get('forge')
+        self.forge_url = pack_config.get('forge_url') or self.forge_url
+        self.forge_ttl = pack_config.get('forge_ttl', self.forge_ttl)
         sponge_version = pack_config.get('sponge')
         assert forge_version or sponge_version, 'no Forge or Sponge version defined'
 
         provider_settings = pack_config.get('provider_settings', {})
         provider_args = {'debug': self.debug, 'output_path': output_path, 'data_path': data_path,
-                         'default_mc_version': mc_version, 'provider_settings': provider_settings}
-
-        print('initializing providers')
+                         'default_mc_version': mc_version, 'provider_settings': provider_settings,
+                         'cache_dir': self.cache_dir, 'store': self.store, 'http': self.http}
 
-        providers: List[BaseProvider] = []
-        providers.append(CurseProvider(**provider_args))
-        providers.append(DirectProvider(**provider_args))
-        providers.append(LocalProvider(**provider_args))
-        providers.append(MavenProvider(**provider_args))
-        providers.append(GithubProvider(**provider_args))
-        providers.append(JenkinsProvider(**provider_args))
+        # providers are created when the first entry of their type needs them
+        provider_map = ProviderMap(provider_registry, provider_args, profiler=profiler)
 
         print(f'output path {output_path}')
         mods = pack_config.get('mods', [])
 
-        provider_map = {p._typ: p for p in providers}
+        entries = EntryRegistry()
+        with profiler.phase('convert'):
+            for mod in mods:
 
-        def find_matching(mod: Any) -> BaseProvider:
-            for provider in providers:
-                if provider.match(mod):
-                    return provider
-            return None
-
-        def assert_dict(check_name: str, keys: Tuple[str], entries: List[dict]):
-            fail = False
-            all_missing = {}
-            for entry in entries:
-                missing = set(keys) - set(entry.keys())
-                if missing:
-                    print(
-                        f"[{check_name}] missing {', '.join(missing)} from \n\t{entry}", file=sys.stderr)
-                    fail = True
-                    entry_id = entry.get('name') or entry.get(
-                        'url') or str(entry)
-                    all_missing[entry_id] = missing
-            assert not fail, f'{check_name} missing values {all_missing}'
-            # raise KeyError(all_missing)
-        
-        entries = []
-        for mod in mods:
-
-            provider = find_matching(mod)
-            if provider:
-                entry = provider.convert(mod)
-                entries.append(dict(entry))
+                provider = provider_map.find_matching(mod)
+                if provider:
+                    entry = provider.convert(mod)
+                    entries.add(entry)
 
 
         if sponge_version:
-            entries.append(self.get_sponge(sponge_version))
-        try:
-            for entry in entries:
-                provider: BaseProvider = provider_map[entry['type']]
-                provider.apply_defaults(entry)
-
-            for entry in entries:
-                provider: BaseProvider = provider_map[entry['type']]
-                provider.prepare_dependencies(entry)
-
-            # add forge
-            forge_entry = self.get_forge(forge_version, mc_version)
-            print(Path(output_path, forge_entry['path']).resolve())
-            rmtree(
-                str(Path(output_path, forge_entry['path']).resolve()), ignore_errors=True)
-            entries.append(forge_entry)
-
-            remove = []
-            for entry in entries:
-                provider: BaseProvider = provider_map[entry['type']]
-                if not provider.validate(entry):
-                    remove.append(entry)
-            if remove or self.debug:
-                remove_dump = '\n    ' + \
-                    yaml.dump(remove).replace('\n', '\n    ')
-                print(f'remove: {remove_dump}')
-            for rem in remove:
-                entries.remove(rem)
-
-            # print(f'entries: \n{yaml.dump(entries)}')
-
-            features = []
-            for entry in entries:
-                provider: BaseProvider = provider_map[entry['type']]
-                provider.resolve_dependencies(entry, entries)
-
-            if self.debug:
-                print(f'entries: \n{yaml.dump(entries)}')
+            entries.add(self.get_sponge(sponge_version))
 
-            for entry in entries:
-                provider: BaseProvider = provider_map[entry['type']]
-                provider.resolve_feature_dependencies(entry, entries, features)
-
-            print(f'features: \n{yaml.dump(features)}')
-
-            if self.debug:
-                print(f'resolve dep entries: \n{yaml.dump(entries)}')
-
-            for entry in entries:
-                provider: BaseProvider = provider_map[entry['type']]
-                provider.fill_information(entry)
-
-            assert_dict('fill_information', ('name', 'package_type'), entries)
-
-            if self.debug:
-                print(f'fill info entries: \n{yaml.dump(entries)}')
+        lock_file = Lockfile(pack_config_path.with_suffix('.lock.json'))
+        pack_hash = config_hash(pack_config)
+        try:
+            locked = not self.update and lock_file.matches(pack_hash)
+            if locked:
+                print(f'pack config is unchanged, using resolved entries from {lock_file.path}')
+                entries = EntryRegistry(lock_file.entries)
+                features = lock_file.features
+            else:
+                entries, features, pins = self.resolve_entries(
+                    entries, provider_map, lock_file, forge_version, mc_version)
+                lock_file.write(pack_hash, entries.to_list(), features, pins)
 
             if self.debug:
                 print("generating graph")
-            generate_graph(entries, path=data_path, pack_name=pack_name)
-
-            for entry in entries:
-                provider: BaseProvider = provider_map[entry['type']]
-                provider.prepare_download(
-                    entry, Path(self.cache_dir, provider._typ))
-
-            assert_dict('prepare_download',
-                        ('url', 'file_name', 'cache_path'), [e for e in entries if e['type'] != 'local'])
-            assert_dict('prepare_download',
-                        ('file_name', 'file'), [e for e in entries if e['type'] == 'local'])
+            with profiler.phase('graph'):
+                generate_graph(entries, path=data_path, pack_name=pack_name)
 
             src_path = Path(output_path, 'src')
 
             # resolve full path
-            for entry in entries:
-                provider: BaseProvider = provider_map[entry['type']]
-                provider.resolve_path(entry)
+            with profiler.phase('resolve_path'):
+                for entry in entries:
+                    provider: BaseProvider = provider_map[entry['type']]
+                    provider.resolve_path(entry)
 
             assert_dict('resolve_path', ('path', 'file_path'), entries)
 
             if self.debug:
-                print(f'resolve path entries: \n{yaml.dump(entries)}')
+                print(f'resolve path entries: \n{dump_entries(entries)}')
 
             # TODO: github, jenkins
 
-            # clear old mods
+            # only changed files are written, stale mods and loaders are removed after the download
+            materializer = Materializer(output_path, Path(data_path, 'manifest.json'),
+                                        mode=pack_config.get('materialize') or 'auto', debug=self.debug)
             mod_path = Path(output_path, 'src', 'mods')
-            rmtree(str(mod_path.resolve()), ignore_errors=True)
             mod_path.mkdir(parents=True, exist_ok=True)
 
             # for entry in entries:
@@ -325,19 +517,36 @@ class Voodoo:
 
             if urls:
                 # requires path to be known
-                for entry in entries:
-                    provider: BaseProvider = provider_map[entry['type']]
-                    provider.write_direct_url(entry, output_path)
+                with profiler.phase('write_direct_url'):
+                    for entry in entries:
+                        provider: BaseProvider = provider_map[entry['type']]
+                        provider.write_direct_url(entry, output_path, materializer)
 
             if self.debug:
                 print(
-                    f'write urls and features entries: \n{yaml.dump(entries)}')
+                    f'write urls and features entries: \n{dump_entries(entries)}')
 
             print('starting download')
 
-            for entry in entries:
-                provider: BaseProvider = provider_map[entry['type']]
-                provider.download(entry, output_path)
+            engine = DownloadEngine(workers=pack_config.get('download_workers'),
+                                    host_workers=pack_config.get('download_host_workers'),
+                                    debug=self.debug, profiler=profiler)
+            try:
+                with profiler.phase('download'):
+                    engine.download([(provider_map[entry['type']], entry) for entry in entries],
+                                    output_path, materializer)
+                with profiler.phase('prune_pack'):
+                    stale = materializer.prune()
+                if stale:
+                    print(f'removed {len(stale)} stale files')
+            finally:
+                self.store.save()
+                materializer.save()
+            if self.prune_cache:
+                with profiler.phase('prune_cache'):
+                    removed, freed = self.cache.prune()
+                if removed:
+                    print(f'evicted {removed} files ({format_size(freed)}) from the cache')
 
         # TODO: generate modpack.json
 
@@ -354,10 +563,9 @@ class Voodoo:
                 includes = []
                 excludes = []
                 for entry_ref in f['entry_refs']:
-                    entry = next(e for e in entries if e['name'] == entry_ref)
-                    include = entry.get('include', [])
-                    include.insert(0, entry['target_path'])
-                    includes.extend(include)
+                    entry = entries.by_name(entry_ref)
+                    includes.append(entry['target_path'])
+                    includes.extend(entry.get('include', []))
                     exclude = entry.get('exclude', [])
                     excludes.extend(exclude)
                     description = entry.get('description')
@@ -408,6 +616,21 @@ class Voodoo:
 
             self.add_to_workspace(location=pack_base, modpacks_path=pack_config.get('output') or 'modpacks')
 
+            with profiler.phase('finish'):
+                for provider in provider_map.values():
+                    provider.finish()
+
+            if profiler.enabled:
+                cache_stats = self.store.load_stats()
+                report = profiler.report(
+                    http_stats=self.http.stats_since(http_snapshot),
+                    cache_stats={k: cache_stats.get(k, 0) - cache_snapshot.get(k, 0) for k in ('hits', 'misses')},
+                    pack=pack_name,
+                    entries=len(entries),
+                    locked=locked)
+                profiler.write(Path(output_path, 'profile.json'), report)
+                print(profiler.summary(report))
+
 
         except KeyError as ke:
             tb = traceback.format_exc()
@@ -419,12 +642,132 @@ class Voodoo:
                         f"{entry_id} \n\tis missing \n\t{', '.join(missing_keys)}")
             else:
                 print(repr(ke))
-                print(f'KeyError {ke} in')
-                print(entry)
                 print(tb)
             raise ke
 
+    def resolve_entries(self, entries: EntryRegistry, provider_map: ProviderMap, lock_file: Lockfile,
+                        forge_version, mc_version: List[str]) -> Tuple[EntryRegistry, List[dict], Dict[str, dict]]:
+        """
+        resolves entries to downloadable files and collects features
+        entries with a unchanged definition reuse the versions pinned in the lockfile
+        returns entries, features and the new pins
+        """
+        profiler = self.profiler
+        for entry in entries:
+            provider: BaseProvider = provider_map[entry['type']]
+            with profiler.phase('apply_defaults', provider._typ):
+                provider.apply_defaults(entry)
+
+        # pin by the definition after defaults, so changed provider settings resolve again
+        definitions = []
+        pinned = set()
+        for entry in entries:
+            key = config_hash({'entry': dict(entry), 'mc_version': mc_version})
+            definitions.append((key, entry, provider_map[entry['type']]))
+            pin = None if self.update else lock_file.pin(key)
+            if pin:
+                entry.update(pin)
+                pinned.add(id(entry))
+        if pinned:
+            print(f'using {len(pinned)} pinned entries from {lock_file.path}')
+
+        for typ, provider in list(provider_map.items()):
+            with profiler.phase('prefetch', typ):
+                provider.prefetch([e for e in entries.by_type(typ) if id(e) not in pinned])
+
+        for entry in entries:
+            if id(entry) in pinned:
+                continue
+            provider: BaseProvider = provider_map[entry['type']]
+            with profiler.phase('prepare_dependencies', provider._typ):
+                provider.prepare_dependencies(entry)
+
+        # add forge
+        sponge_version = self.sponge_entry['version'] if self.sponge_entry else None
+        forge_key = config_hash({'forge': forge_version, 'mc_version': mc_version, 'sponge': sponge_version})
+        forge_entry = None if self.update else lock_file.pin(forge_key)
+        if not forge_entry:
+            with profiler.phase('forge'):
+                forge_entry = self.get_forge(forge_version, mc_version)
+        forge_pin = dict(forge_entry)
+        entries.add(forge_entry)
+
+        remove = []
+        for entry in entries:
+            provider: BaseProvider = provider_map[entry['type']]
+            with profiler.phase('validate', provider._typ):
+                if not provider.validate(entry):
+                    remove.append(entry)
+        if remove or self.debug:
+            remove_dump = '\n    ' + \
+                dump_entries(remove).replace('\n', '\n    ')
+            print(f'remove: {remove_dump}')
+        for rem in remove:
+            entries.remove(rem)
+
+        # print(f'entries: \n{dump_entries(entries)}')
+
+        # dependencies added by providers are pinned by their own keys
+        dependency_resolver = DependencyResolver(entries, debug=self.debug, pins=None if self.update else lock_file.pins)
+        with profiler.phase('resolve_dependencies'):
+            dependency_resolver.resolve(provider_map)
+        # before prepare_download changes the type of entries
+        for entry in entries:
+            key = dependency_resolver.keys.get(id(entry))
+            if key:
+                definitions.append((key, entry, provider_map[entry['type']]))
+
+        if self.debug:
+            print(f'entries: \n{dump_entries(entries)}')
+
+        with profiler.phase('features'):
+            feature_resolver = FeatureResolver(entries, debug=self.debug)
+            for entry in entries:
+                provider: BaseProvider = provider_map[entry['type']]
+                provider.resolve_feature_dependencies(entry, feature_resolver)
+            features = feature_resolver.features
+
+        if self.debug:
+            print(f'features: \n{yaml.dump(features)}')
+
+        if self.debug:
+            print(f'resolve dep entries: \n{dump_entries(entries)}')
+
+        for entry in entries:
+            provider: BaseProvider = provider_map[entry['type']]
+            with profiler.phase('fill_information', provider._typ):
+                provider.fill_information(entry)
+
+        assert_dict('fill_information', ('name', 'package_type'), entries)
+
+        if self.debug:
+            print(f'fill info entries: \n{dump_entries(entries)}')
+
+        for entry in entries:
+            provider: BaseProvider = provider_map[entry['type']]
+            with profiler.phase('prepare_download', provider._typ):
+                provider.prepare_download(
+                    entry, Path(self.cache_dir, provider._typ))
+
+        assert_dict('prepare_download',
+                    ('url', 'file_name', 'cache_path'), [e for e in entries if e['type'] != 'local'])
+        assert_dict('prepare_download',
+                    ('file_name', 'file'), entries.by_type('local'))
+
+        resolved = {id(e) for e in entries}
+        pins = {forge_key: forge_pin}
+        for key, entry, provider in definitions:
+            pin = {k: entry[k] for k in provider._pin_keys if k in entry}
+            if pin and id(entry) in resolved:
+                pins[key] = pin
+        return entries, features, pins
+
     def add_to_workspace(self, location: str, modpacks_path: Path):
+        # packs built in parallel share the workspace file
+        with self._workspace_lock:
+            self._add_to_workspace(location, modpacks_path)
+
+    def _add_to_workspace(self, location: str, modpacks_path: Path):
         location = Path(location).stem
         path = Path(modpacks_path,
                     '.modpacks', 'workspace.json')
@@ -453,59 +796,65 @@ class Voodoo:
         with open(path, 'w') as workspace_file:
             json.dump(workspace, workspace_file, indent=4 * ' ')
 
-    def get_forge_data(self) -> List[Dict[str, Any]]:
+    def get_forge_index(self, refresh: bool = False) -> ForgeIndex:
+        """
+        the forge index of `forge_url`, shared by all packs built in this process
+
+        the index is kept in the cache and revalidated with a conditional request once it is older than `forge_ttl`,
+        `refresh` revalidates it right away
+        """
+        with self._forge_lock:
+            index = self.forge_indexes.get(self.forge_url)
+            # long running processes load the index again once it is due for revalidation
+            if index is None or self.forge_ttl is None or time.time() - index.loaded >= self.forge_ttl \
+                    or (refresh and not index.checked):
+                index = self.forge_indexes[self.forge_url] = self.load_forge_index(refresh)
+            return index
+
+    def load_forge_index(self, refresh: bool = False) -> ForgeIndex:
+        import requests
+        forge_host = urlparse(self.forge_url).netloc.replace(':', '_') or 'default'
+        snapshot = CachedDocument(Path(self.cache_dir, 'meta', 'forge', forge_host, 'index.json'))
+        if not refresh and snapshot.fresh(self.forge_ttl):
+            if self.debug:
+                print(f'using forge index {snapshot.path}')
+            return ForgeIndex.from_json(snapshot.load_json())
+
         if self.debug:
-            print(
-                f'get http://files.minecraftforge.net/maven/net/minecraftforge/forge/json')
-        r = requests.get(
-            f'http://files.minecraftforge.net/maven/net/minecraftforge/forge/json')
-        r.raise_for_status()
-        global addonData
-        if r.status_code == 200:
-            forge_data = r.json()
-            return forge_data
-        return None
+            print(f'get {self.forge_url}')
+        try:
+            r = self.http.get(self.forge_url, headers=snapshot.validators())
+            if r.status_code == 304:
+                snapshot.touch()
+                index = ForgeIndex.from_json(snapshot.load_json())
+                index.checked = True
+                return index
+            r.raise_for_status()
+        except requests.RequestException as e:
+            if not snapshot.exists():
+                raise
+            print(f'WARNING: failed to refresh the forge index, using snapshot from {snapshot.path}: {e}',
+                  file=sys.stderr)
+            return ForgeIndex.from_json(snapshot.load_json())
+        index = ForgeIndex.from_forge_data(r.json())
+        # only the index is kept, the validators still belong to the full document
+        snapshot.store(json.dumps(index.to_json()).encode(), r.headers, url=self.forge_url)
+        index.checked = True
+        return index
 
     def get_forge_url(self, version, mc_version: List[str]) -> (str, str, int):
-        if not self.forge_data:
-            self.forge_data = self.get_forge_data()
-        data = self.forge_data
         if isinstance(mc_version, list):
             mc_version = mc_version[0]
-        if isinstance(version, str):
-            version_str = version
-            if version in ('recommended', 'latest'):
-                promo_version = f'{mc_version}-{version}'
-                version = data['promos'].get(promo_version)
-            else:
-                version = data['promos'].get(version_str)
-                if not version:
-                    version = data['branches'].get(version_str)
-                if not version:
-                    version = data['mcversion'].get(version_str)
-                if isinstance(version, list):
-                    version_list = [
-                        v for v in version if data['number'][str(v)]['mcversion'] == mc_version]
-                    if not version_list:
-                        print(f'ERROR: forge searchterm is invalid',
-                              file=sys.stderr)
-                        exit(-1)
-                    version = max(version_list)
-
-        webpath = data['webpath']
-        if isinstance(version, int):
-            file_data = data['number'][str(version)]
-            mcversion = file_data['mcversion']
-            forge_version = file_data['version']
-            branch = file_data['branch']
-            longversion = f'{mcversion}-{forge_version}'
-            if branch:
-                longversion = f'{longversion}-{branch}'
-            filename = f'forge-{longversion}-installer.jar'
-            url = f'{webpath}/{longversion}/{filename}'
-            return url, filename, longversion
-        assert isinstance(
-            version, int), 'version should be resolved to buildnumber'
+        index = self.get_forge_index()
+        build = index.find_build(version, mc_version)
+        if build is None and not index.checked:
+            # the cached index may predate the version
+            index = self.get_forge_index(refresh=True)
+            build = index.find_build(version, mc_version)
+        if build is None:
+            print(f'ERROR: forge searchterm {version} is invalid for {mc_version}', file=sys.stderr)
+            exit(-1)
+        return index.installer(build)
 
     def get_forge(self, version, mcversion: List[str]):
         if self.sponge_entry:
@@ -523,11 +872,12 @@ class Voodoo:
             file_name=file_name,
             package_type='loader',
             path='loaders',
+            immutable=True,
         )
         return entry
 
     def get_sponge(self, sponge_version):
-        entry = dict(
+        entry = Entry(
             type='mvn',
             name='Sponge Forge',
             remote_repository="https://repo.spongepowered.org/maven/",
@@ -546,7 +896,7 @@ class Voodoo:
     def exPort(self, pack_config_path, pack_base): #mods: List[Any], mc_version, pack_base, pack_name, data_path):
         output = io.StringIO()
 
-        default_config = pkg_resources.resource_string(__name__, 'data/default_export.yaml').decode()
+        default_config = Path(DATA_PATH, 'default_export.yaml').read_text(encoding='utf-8')
         output.write(default_config)
         
         if pack_config_path.exists():
@@ -0,0 +1,53 @@
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+__all__ = ['FileWatcher']
+
+Stamp = Optional[Tuple[int, int]]
+
+
+class FileWatcher:
+    """
+    polls the modification time and size of files
+
+    a change is only reported once the file stayed the same for one more poll,
+    so editors that write files in several steps trigger a single rebuild
+    """
+
+    def __init__(self, paths: Iterable[Path] = ()):
+        self._seen: Dict[Path, Stamp] = {}
+        self._pending: Dict[Path, Stamp] = {}
+        for path in paths:
+            self.add(path)
+
+    @staticmethod
+    def stamp(path: Path) -> Stamp:
+        try:
+            stat = os.stat(str(path))
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def add(self, path: Path):
+        path = Path(path).resolve()
+        if path not in self._seen:
+            self._seen[path] = self.stamp(path)
+
+    def poll(self) -> List[Path]:
+        """
+        files that changed since they were last reported, deleted files are not reported
+        """
+        changed = []
+        for path, seen in self._seen.items():
+            stamp = self.stamp(path)
+            if stamp == seen:
+                self._pending.pop(path, None)
+            elif self._pending.get(path, seen) == stamp:
+                self._seen[path] = stamp
+                del self._pending[path]
+                if stamp is not None:
+                    changed.append(path)
+            else:
+                self._pending[path] = stamp
+        return changed